@@ -309,6 +309,7 @@ class GeoreferencingOutput(OutputCreator):
 class CDROutput(GeoreferencingOutput):
     def __init__(self, id: str):
         super().__init__(id)
+        self._mapper = GeoreferenceMapper("georeferencing", "0.0.1")
 
     def create_output(self, pipeline_result: PipelineResult) -> Output:
         assert pipeline_result.image is not None
@@ -320,8 +321,7 @@ class CDROutput(GeoreferencingOutput):
             logger.error("Failed to create georeferencing cdr output")
             return results
 
-        mapper = GeoreferenceMapper("georeferencing", "0.0.1")
-        cdr_georeferencing = mapper.map_to_cdr(results.data)
+        cdr_georeferencing = self._mapper.map_to_cdr(results.data)
         return BaseModelOutput(
             pipeline_result.pipeline_id,
             pipeline_result.pipeline_name,
@@ -141,6 +141,7 @@ class MetadataExtractionOutput(OutputCreator):
 class CDROutput(OutputCreator):
     def __init__(self, id: str):
         super().__init__(id)
+        self._mapper = MetadataMapper(MODEL_NAME, MODEL_VERSION)
 
     def create_output(self, pipeline_result: PipelineResult) -> Output:
         """
@@ -159,9 +160,7 @@ class CDROutput(OutputCreator):
         metadata_extraction = MetadataExtraction.model_validate(
             pipeline_result.data[METADATA_EXTRACTION_OUTPUT_KEY]
         )
-        mapper = MetadataMapper(MODEL_NAME, MODEL_VERSION)
-
-        cdr_metadata = mapper.map_to_cdr(metadata_extraction)
+        cdr_metadata = self._mapper.map_to_cdr(metadata_extraction)
         return BaseModelOutput(
             pipeline_result.pipeline_id, pipeline_result.pipeline_name, cdr_metadata
         )
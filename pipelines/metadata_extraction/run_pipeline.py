@@ -1,10 +1,13 @@
 import argparse
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 import logging
 import os
 
 from PIL.Image import Image as PILImage
 from numpy import isin
+from typing import List
 
 from tasks.common.pipeline import (
     EmptyOutput,
@@ -19,6 +22,7 @@ from tasks.common.io import (
     ImageFileInputIterator,
     ImageFileWriter,
     JSONFileWriter,
+    JSONLFileWriter,
     validate_s3_config,
 )
 from tasks.metadata_extraction.metadata_extraction import (
@@ -37,6 +41,7 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", type=Path, required=True)
     parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--output_jsonl", type=str, default=None)
     parser.add_argument("--workdir", type=str, default=None)
     parser.add_argument("--model", type=str, default=None)
     parser.add_argument("--cdr_schema", action="store_true")
@@ -78,32 +83,63 @@ def main():
         not p.no_gpu,
     )
 
+    # optionally stream all metadata results into a single json lines file, in addition to the
+    # per-document outputs
+    jsonl_context = JSONLFileWriter(p.output_jsonl) if p.output_jsonl else nullcontext()
+
+    # json outputs are written on a single pool for the whole run, so s3 upload latency overlaps
+    # with the processing of the following documents
+    json_writes: List[Future] = []
+
     # run the extraction pipeline
-    for doc_id, image in input:
-        image_input = PipelineInput(image=image, raster_id=doc_id)
-        results = pipeline.run(image_input)
-
-        # write the results out to the file system or s3 bucket
-        for output_type, output_data in results.items():
-            if isinstance(output_data, BaseModelOutput):
-                if output_type == "metadata_extraction_output":
-                    path = os.path.join(p.output, f"{doc_id}_metadata_extraction.json")
-                    file_writer.process(path, output_data.data)
-                elif output_type == "metadata_cdr_output" and p.cdr_schema:
-                    path = os.path.join(
-                        p.output, f"{doc_id}_metadata_extraction_cdr.json"
-                    )
-                    file_writer.process(path, output_data.data)
-            elif isinstance(output_data, ImageOutput):
-                # write out the image
-                path = os.path.join(p.output, f"{doc_id}_metadata_extraction.png")
-                assert isinstance(output_data.data, PILImage)
-                image_writer.process(path, output_data.data)
-            elif isinstance(output_data, EmptyOutput):
-                logger.info(f"Empty {output_type} output for {doc_id}")
-            else:
-                logger.warning(f"Unknown output type: {type(output_data)}")
-                continue
+    with ThreadPoolExecutor(
+        max_workers=JSONFileWriter.MAX_UPLOAD_WORKERS
+    ) as json_executor, jsonl_context as jsonl_writer:
+        for doc_id, image in input:
+            image_input = PipelineInput(image=image, raster_id=doc_id)
+            results = pipeline.run(image_input)
+
+            # write the results out to the file system or s3 bucket
+            for output_type, output_data in results.items():
+                if isinstance(output_data, BaseModelOutput):
+                    if output_type == "metadata_extraction_output":
+                        if jsonl_writer:
+                            jsonl_writer.process(output_data.data)
+                        path = os.path.join(
+                            p.output, f"{doc_id}_metadata_extraction.json"
+                        )
+                        json_writes.append(
+                            json_executor.submit(
+                                file_writer.process, path, output_data.data
+                            )
+                        )
+                    elif output_type == "metadata_cdr_output" and p.cdr_schema:
+                        path = os.path.join(
+                            p.output, f"{doc_id}_metadata_extraction_cdr.json"
+                        )
+                        json_writes.append(
+                            json_executor.submit(
+                                file_writer.process, path, output_data.data
+                            )
+                        )
+                elif isinstance(output_data, ImageOutput):
+                    # write out the image
+                    path = os.path.join(p.output, f"{doc_id}_metadata_extraction.png")
+                    assert isinstance(output_data.data, PILImage)
+                    image_writer.process(path, output_data.data)
+                elif isinstance(output_data, EmptyOutput):
+                    logger.info(f"Empty {output_type} output for {doc_id}")
+                else:
+                    logger.warning(f"Unknown output type: {type(output_data)}")
+                    continue
+
+            # surface any failed writes as they complete
+            for write in [w for w in json_writes if w.done()]:
+                write.result()
+                json_writes.remove(write)
+
+    for write in json_writes:
+        write.result()
 
 
 if __name__ == "__main__":
@@ -173,6 +173,7 @@ class CDROutput(OutputCreator):
             id (str): The ID of the output creator.
         """
         super().__init__(id)
+        self._mapper = PointsMapper(MODEL_NAME, MODEL_VERSION)
 
     def create_output(self, pipeline_result: PipelineResult) -> Output:
         """
@@ -188,9 +189,7 @@ class CDROutput(OutputCreator):
             pipeline_result.data[MAP_PT_LABELS_OUTPUT_KEY]
         )
 
-        mapper = PointsMapper(MODEL_NAME, MODEL_VERSION)
-
-        cdr_points = mapper.map_to_cdr(map_point_labels)
+        cdr_points = self._mapper.map_to_cdr(map_point_labels)
         return BaseModelOutput(
             pipeline_result.pipeline_id, pipeline_result.pipeline_name, cdr_points
         )
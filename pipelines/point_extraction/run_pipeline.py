@@ -68,89 +68,94 @@ def main():
         batch_size=p.batch_size,
     )
 
-    # run the extraction pipeline
-    for doc_id, image in input:
-
-        # --- TEMP code needed to run with contest dir-based data
-        if (
-            doc_id.endswith("_pt")
-            or doc_id.endswith("_poly")
-            or doc_id.endswith("_line")
-            or doc_id.endswith("_point")
-        ):
-            logger.info(f"Skipping {doc_id}")
-            continue
-        # ---
-        logger.info(f"Processing {doc_id}")
-        image_input = PipelineInput(image=image, raster_id=doc_id)
-
-        if p.legend_items_dir:
-            # load JSON legend annotations file, if present, parse and add to PipelineInput
-            # expected format is LegendItemResponse CDR pydantic objects
-            try:
-                # check for legend annotations for this image
-                with open(
-                    os.path.join(p.legend_items_dir, doc_id + ".json"), "r"
-                ) as fp:
-                    legend_anns = json.load(fp)
-                    legend_pt_items = parse_legend_annotations(legend_anns, doc_id)
-                    # add legend item annotations as a pipeline input param
-                    image_input.params[LEGEND_ITEMS_OUTPUT_KEY] = legend_pt_items
-                    logger.info(
-                        f"Number of legend point items loaded for this map: {len(legend_pt_items.items)}"
+    # run the extraction pipeline, releasing the pipeline's resources when done
+    try:
+        for doc_id, image in input:
+
+            # --- TEMP code needed to run with contest dir-based data
+            if (
+                doc_id.endswith("_pt")
+                or doc_id.endswith("_poly")
+                or doc_id.endswith("_line")
+                or doc_id.endswith("_point")
+            ):
+                logger.info(f"Skipping {doc_id}")
+                continue
+            # ---
+            logger.info(f"Processing {doc_id}")
+            image_input = PipelineInput(image=image, raster_id=doc_id)
+
+            if p.legend_items_dir:
+                # load JSON legend annotations file, if present, parse and add to PipelineInput
+                # expected format is LegendItemResponse CDR pydantic objects
+                try:
+                    # check for legend annotations for this image
+                    with open(
+                        os.path.join(p.legend_items_dir, doc_id + ".json"), "r"
+                    ) as fp:
+                        legend_anns = json.load(fp)
+                        legend_pt_items = parse_legend_annotations(legend_anns, doc_id)
+                        # add legend item annotations as a pipeline input param
+                        image_input.params[LEGEND_ITEMS_OUTPUT_KEY] = legend_pt_items
+                        logger.info(
+                            f"Number of legend point items loaded for this map: {len(legend_pt_items.items)}"
+                        )
+
+                except Exception as e:
+                    logger.error("EXCEPTION loading legend items json: " + repr(e))
+
+            elif p.legend_hints_dir:
+                # load JSON legend hints file, if present, parse and add to PipelineInput
+                try:
+                    # check for legend hints for this image (JSON CMA contest data)
+                    with open(
+                        os.path.join(p.legend_hints_dir, doc_id + ".json"), "r"
+                    ) as fp:
+                        legend_hints = json.load(fp)
+                        legend_pt_items = parse_legend_point_hints(legend_hints, doc_id)
+                        # add legend item hints as a pipeline input param
+                        image_input.params[LEGEND_ITEMS_OUTPUT_KEY] = legend_pt_items
+                        logger.info(
+                            f"Number of legend point items loaded for this map: {len(legend_pt_items.items)}"
+                        )
+
+                except Exception as e:
+                    logger.error("EXCEPTION loading legend hints json: " + repr(e))
+
+            if p.bitmasks:
+                bitmasks_out_dir = os.path.join(p.output, "bitmasks")
+                os.makedirs(bitmasks_out_dir, exist_ok=True)
+                if not p.legend_hints_dir and not p.legend_items_dir:
+                    logger.warning(
+                        'Points pipeline is configured to create CMA contest bitmasks without using legend annotations! Setting "legend_hints_dir" or "legend_items_dir" param is recommended.'
                     )
 
-            except Exception as e:
-                logger.error("EXCEPTION loading legend items json: " + repr(e))
-
-        elif p.legend_hints_dir:
-            # load JSON legend hints file, if present, parse and add to PipelineInput
-            try:
-                # check for legend hints for this image (JSON CMA contest data)
-                with open(
-                    os.path.join(p.legend_hints_dir, doc_id + ".json"), "r"
-                ) as fp:
-                    legend_hints = json.load(fp)
-                    legend_pt_items = parse_legend_point_hints(legend_hints, doc_id)
-                    # add legend item hints as a pipeline input param
-                    image_input.params[LEGEND_ITEMS_OUTPUT_KEY] = legend_pt_items
-                    logger.info(
-                        f"Number of legend point items loaded for this map: {len(legend_pt_items.items)}"
-                    )
-
-            except Exception as e:
-                logger.error("EXCEPTION loading legend hints json: " + repr(e))
-
-        if p.bitmasks:
-            bitmasks_out_dir = os.path.join(p.output, "bitmasks")
-            os.makedirs(bitmasks_out_dir, exist_ok=True)
-            if not p.legend_hints_dir and not p.legend_items_dir:
-                logger.warning(
-                    'Points pipeline is configured to create CMA contest bitmasks without using legend annotations! Setting "legend_hints_dir" or "legend_items_dir" param is recommended.'
-                )
-
-        results = pipeline.run(image_input)
-
-        # write the results out to the file system or s3 bucket
-        for output_type, output_data in results.items():
-            if isinstance(output_data, BaseModelOutput):
-                if output_type == "map_point_label_output":
-                    path = os.path.join(p.output, f"{doc_id}_point_extraction.json")
-                    file_writer.process(path, output_data.data)
-                elif output_type == "map_point_label_cdr_output" and p.cdr_schema:
-                    path = os.path.join(p.output, f"{doc_id}_point_extraction_cdr.json")
-                    file_writer.process(path, output_data.data)
-            elif isinstance(output_data, ImageDictOutput) and p.bitmasks:
-                # write out the binary raster images
-                for pt_label, pil_im in output_data.data.items():
-                    raster_path = os.path.join(
-                        bitmasks_out_dir, f"{doc_id}_{pt_label}.tif"
-                    )
-                    image_writer.process(raster_path, pil_im)
-            elif isinstance(output_data, EmptyOutput):
-                logger.info(f"Empty {output_type} output for {doc_id}")
-            else:
-                logger.warning(f"Unknown output data: {output_data}")
+            results = pipeline.run(image_input)
+
+            # write the results out to the file system or s3 bucket
+            for output_type, output_data in results.items():
+                if isinstance(output_data, BaseModelOutput):
+                    if output_type == "map_point_label_output":
+                        path = os.path.join(p.output, f"{doc_id}_point_extraction.json")
+                        file_writer.process(path, output_data.data)
+                    elif output_type == "map_point_label_cdr_output" and p.cdr_schema:
+                        path = os.path.join(
+                            p.output, f"{doc_id}_point_extraction_cdr.json"
+                        )
+                        file_writer.process(path, output_data.data)
+                elif isinstance(output_data, ImageDictOutput) and p.bitmasks:
+                    # write out the binary raster images
+                    for pt_label, pil_im in output_data.data.items():
+                        raster_path = os.path.join(
+                            bitmasks_out_dir, f"{doc_id}_{pt_label}.tif"
+                        )
+                        image_writer.process(raster_path, pil_im)
+                elif isinstance(output_data, EmptyOutput):
+                    logger.info(f"Empty {output_type} output for {doc_id}")
+                else:
+                    logger.warning(f"Unknown output data: {output_data}")
+    finally:
+        pipeline.close()
 
 
 if __name__ == "__main__":
@@ -124,10 +124,13 @@ if __name__ == "__main__":
 
     #### start flask server or startup up the message queue
     if p.rest:
-        if p.debug:
-            app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
-        else:
-            app.run(host="0.0.0.0", port=5000)
+        try:
+            if p.debug:
+                app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
+            else:
+                app.run(host="0.0.0.0", port=5000)
+        finally:
+            point_extraction_pipeline.close()
     else:
         client = RequestClient(
             point_extraction_pipeline,
@@ -120,6 +120,7 @@ class CDROutput(OutputCreator):
             id (str): The ID of the output creator.
         """
         super().__init__(id)
+        self._mapper = SegmentationMapper(MODEL_NAME, MODEL_VERSION)
 
     def create_output(self, pipeline_result: PipelineResult) -> Output:
         """
@@ -136,9 +137,7 @@ class CDROutput(OutputCreator):
             return EmptyOutput()
 
         map_segmentation = MapSegmentation.model_validate(result)
-        mapper = SegmentationMapper(MODEL_NAME, MODEL_VERSION)
-
-        cdr_segmentation = mapper.map_to_cdr(map_segmentation)
+        cdr_segmentation = self._mapper.map_to_cdr(map_segmentation)
         return BaseModelOutput(
             pipeline_result.pipeline_id, pipeline_result.pipeline_name, cdr_segmentation
         )
@@ -1,6 +1,7 @@
 from PIL import Image
 from PIL.Image import Image as PILImage
 import cv2
+import hashlib
 import numpy as np
 import logging
 from io import BytesIO
@@ -82,3 +83,13 @@ def normalize_image_format(im: PILImage) -> PILImage:
     if im.mode in ("RGBA", "P", "1", "L"):
         im = im.convert("RGB")
     return im
+
+
+def image_content_hash(im: PILImage) -> bytes:
+    """
+    Hash a Pillow image's pixel content (including its mode and size),
+    used to find images with identical pixels
+    """
+    digest = hashlib.blake2b(im.tobytes(), digest_size=16)
+    digest.update(f"{im.mode}_{im.size}".encode("utf-8"))
+    return digest.digest()
@@ -4,9 +4,11 @@ import os
 import re
 import json
 import sys
+import threading
 from urllib.parse import urlparse
 from enum import Enum
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 from botocore.config import Config
 from botocore import UNSIGNED
@@ -148,17 +150,56 @@ class ImageFileInputIterator(Iterator[Tuple[str, PILImage]]):
 class JSONFileWriter:
     """Writes a BaseModel as a JSON file to either the local file system or an s3 bucket"""
 
+    # max number of concurrent s3 uploads when writing multiple outputs
+    MAX_UPLOAD_WORKERS = 16
+
+    def __init__(self) -> None:
+        # s3 clients are shared per endpoint - boto3 client creation isn't thread safe so it is
+        # guarded, but the clients themselves can be used across threads
+        self._clients: Dict[Optional[str], Any] = {}
+        self._clients_lock = threading.Lock()
+
     def process(self, output_location: str, data: BaseModel | Dict) -> None:
         """Writes metadata to a json file on the local file system or to an s3 bucket based
-        on the output location format"""
+        on the output location format.  Safe to call concurrently."""
 
         # check to see if path is an s3 uri - otherwise treat it as a file path
         source = get_file_source(output_location)
         if source == Mode.S3_URI or source == Mode.URL:
-            self._write_to_s3(data, output_location)
+            self._write_to_s3(
+                data, output_location, self._get_s3_client(output_location)
+            )
         else:
             self._write_to_file(data, Path(output_location))
 
+    def process_many(
+        self,
+        outputs: List[Tuple[str, BaseModel | Dict]],
+        max_workers: int = MAX_UPLOAD_WORKERS,
+    ) -> None:
+        """Writes multiple (output location, data) pairs concurrently, so the round trip latency
+        of each s3 upload overlaps with the others"""
+
+        max_workers = min(max_workers, len(outputs))
+        if max_workers <= 1:
+            for output_location, data in outputs:
+                self.process(output_location, data)
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda output: self.process(*output), outputs))
+
+    def _get_s3_client(self, output_location: str) -> Any:
+        """Returns the shared s3 client for the output location's endpoint"""
+
+        endpoint_url = get_s3_endpoint_url(output_location)
+        with self._clients_lock:
+            if endpoint_url not in self._clients:
+                self._clients[endpoint_url] = boto3.client(
+                    "s3", endpoint_url=endpoint_url
+                )
+            return self._clients[endpoint_url]
+
     @staticmethod
     def _write_to_file(data: BaseModel | Dict, output_location: Path) -> None:
         """Writes metadata to a json file"""
@@ -167,43 +208,69 @@ class JSONFileWriter:
         if output_location.is_dir():
             raise ValueError(f"Output location {output_location} is not a file.")
 
-        output_dir = output_location.parent
-        if not output_dir.exists():
-            os.makedirs(output_dir)
+        os.makedirs(output_location.parent, exist_ok=True)
 
         # write the data to the output file
-        with open(output_location, "w") as outfile:
-            data_to_write = data.model_dump() if isinstance(data, BaseModel) else data
-            json.dump(data_to_write, outfile)
+        output_location.write_bytes(to_json_bytes(data))
 
     @staticmethod
-    def _write_to_s3(data: BaseModel | Dict, output_uri: str) -> None:
-        """Writes metadata to an s3 bucket"""
+    def _write_to_s3(
+        data: BaseModel | Dict, output_uri: str, client: Optional[Any] = None
+    ) -> None:
+        """Writes metadata to an s3 bucket, creating a client based on the mode if one isn't supplied"""
 
-        # create s3 client based on the mode
         mode = get_file_source(output_uri)
-        if mode == Mode.S3_URI:
-            client = boto3.client("s3")
-        elif mode == Mode.URL:
-            parsed_url = urlparse(output_uri)
-            client = boto3.client(
-                "s3", endpoint_url=f"{parsed_url.scheme}://{parsed_url.netloc}"
-            )
+        if client is None:
+            client = boto3.client("s3", endpoint_url=get_s3_endpoint_url(output_uri))
 
         # extract bucket from s3 uri
         bucket, key = parse_s3_reference(output_uri, mode)
 
         # write data to the bucket
-        json_model = (
-            data.model_dump_json() if isinstance(data, BaseModel) else json.dumps(data)
-        )
         client.put_object(
-            Body=bytes(json_model.encode("utf-8")),
+            Body=to_json_bytes(data),
             Bucket=bucket,
             Key=key,
+            ContentType="application/json",
         )
 
 
+class JSONLFileWriter:
+    """Streams BaseModels as JSON lines to a file on the local file system, keeping memory use
+    constant regardless of how many results are written"""
+
+    def __init__(self, output_location: str) -> None:
+        """Opens the output file for appending"""
+
+        if get_file_source(output_location) != Mode.FILE:
+            raise ValueError(
+                f"JSON lines output location {output_location} must be a local file."
+            )
+
+        output_path = Path(output_location)
+        if output_path.is_dir():
+            raise ValueError(f"Output location {output_location} is not a file.")
+        os.makedirs(output_path.parent, exist_ok=True)
+
+        self._outfile = open(output_path, "ab")
+
+    def process(self, data: BaseModel | Dict) -> None:
+        """Appends the data to the output file as a single JSON line"""
+
+        self._outfile.write(to_json_bytes(data) + b"\n")
+        self._outfile.flush()
+
+    def close(self) -> None:
+        """Closes the output file"""
+        self._outfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
 class BytesIOFileWriter:
     """Write bytes to a file on the local file system or an s3 bucket"""
 
@@ -226,13 +293,10 @@ class BytesIOFileWriter:
         if output_location.is_dir():
             raise ValueError(f"Output location {output_location} is not a file.")
 
-        output_dir = output_location.parent
-        if not output_dir.exists():
-            os.makedirs(output_dir)
+        os.makedirs(output_location.parent, exist_ok=True)
 
         # write the data to the output file
-        with open(output_location, "wb") as outfile:
-            outfile.write(data.getvalue())
+        output_location.write_bytes(data.getvalue())
 
     @staticmethod
     def _write_to_s3(data: io.BytesIO, output_uri: str, mode: Mode) -> None:
@@ -387,7 +451,8 @@ class JSONFileReader:
         if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
             raise Exception(f"Failed to read from s3 bucket {bucket} with key {key}.")
 
-        data = json.loads(response["Body"].read().decode("utf-8"))
+        # json.loads detects and decodes the utf-8 body itself
+        data = json.loads(response["Body"].read())
         return data
 
 
@@ -409,6 +474,23 @@ def parse_s3_reference(path: str, mode: Mode) -> Tuple[str, str]:
     return (bucket, key)
 
 
+def to_json_bytes(data: BaseModel | Dict) -> bytes:
+    """Serializes a BaseModel or dict to UTF-8 encoded JSON in a single pass - BaseModels are serialized
+    directly by pydantic rather than being dumped to a dict and walked again by the json module
+    """
+    if isinstance(data, BaseModel):
+        return data.model_dump_json().encode("utf-8")
+    return json.dumps(data).encode("utf-8")
+
+
+def get_s3_endpoint_url(uri: str) -> Optional[str]:
+    """Returns the endpoint url for an s3 reference - None for s3 uris, which use the default endpoint"""
+    if get_file_source(uri) == Mode.URL:
+        parsed_url = urlparse(uri)
+        return f"{parsed_url.scheme}://{parsed_url.netloc}"
+    return None
+
+
 def get_file_source(path: str) -> Mode:
     """Checks if the path is a file, s3 uri, or url"""
     parsed_url = urlparse(path)
@@ -175,6 +175,11 @@ class Pipeline:
 
         return self._produce_output(pipeline_result)
 
+    def close(self) -> None:
+        """Releases any resources held by the pipeline's tasks"""
+        for t in self._tasks:
+            t.close()
+
     def _initialize_result(self, input: PipelineInput) -> PipelineResult:
         result = PipelineResult()
         result.data["image"] = input.image
@@ -151,6 +151,12 @@ class Task:
     def get_task_id(self) -> str:
         return self._task_id
 
+    def close(self):
+        """
+        Release any resources held across runs (eg. connection pools) - no-op by default
+        """
+        pass
+
     def _create_result(self, input: TaskInput) -> TaskResult:
         result = TaskResult()
         result.task_id = self._task_id
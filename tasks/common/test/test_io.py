@@ -13,6 +13,7 @@ from tasks.common.io import (
     ImageFileReader,
     JSONFileReader,
     JSONFileWriter,
+    JSONLFileWriter,
     ImageFileWriter,
 )
 
@@ -138,6 +139,23 @@ def test_json_file_writer_filesystem():
     os.remove(output_location)
 
 
+def test_jsonl_file_writer_filesystem():
+    # Test streaming multiple BaseModel and dict instances
+    output_location = "tasks/common/test/data/test.jsonl"
+    with JSONLFileWriter(output_location) as writer:
+        writer.process(TestData(name="test", color="red"))
+        writer.process({"name": "test2", "color": "blue"})
+
+    with open(output_location, "r") as f:
+        data = [json.loads(line) for line in f]
+        assert data == [
+            {"name": "test", "color": "red"},
+            {"name": "test2", "color": "blue"},
+        ]
+
+    os.remove(output_location)
+
+
 @mock_aws
 def test_json_file_writer_s3():
     # Create a temporary directory and save some test images
@@ -156,6 +174,29 @@ def test_json_file_writer_s3():
     assert data == {"name": "test", "color": "red"}
 
 
+@mock_aws
+def test_json_file_writer_process_many_s3():
+    test_bucket = "test-bucket"
+    conn = boto3.resource("s3", region_name="us-east-1")
+    bucket = conn.create_bucket(Bucket=test_bucket)
+
+    # Test writing multiple instances concurrently
+    outputs = [
+        (
+            f"s3://test-bucket/data/test_{i}.json",
+            TestData(name=f"test_{i}", color="red"),
+        )
+        for i in range(20)
+    ]
+    writer = JSONFileWriter()
+    writer.process_many(outputs, max_workers=4)
+
+    for i in range(20):
+        obj = bucket.Object(f"data/test_{i}.json")
+        data = json.loads(obj.get()["Body"].read())
+        assert data == {"name": f"test_{i}", "color": "red"}
+
+
 @mock_aws
 def test_image_writer_s3():
     # Create a temporary directory and save a test image
@@ -1,16 +1,21 @@
-import copy
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import lru_cache
 import logging
 import re
+import string
 from enum import Enum
 import sys
 import cv2
-import numpy as np
 from PIL.Image import Image as PILImage
-from langchain.schema import SystemMessage, PromptValue
-from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
-from langchain.output_parsers import PydanticOutputParser
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.prompt_values import PromptValue
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
+from langchain_core.runnables import Runnable, RunnableLambda
 from langchain_openai import AzureChatOpenAI, ChatOpenAI
+import openai
 from pydantic import BaseModel, Field
 import tiktoken
 from tasks.common.image_io import pil_to_cv_image
@@ -22,7 +27,11 @@ from tasks.metadata_extraction.entities import (
     METADATA_EXTRACTION_OUTPUT_KEY,
 )
 from tasks.geo_referencing.entities import MapROI, ROI_MAP_OUTPUT_KEY
-from tasks.segmentation.entities import SEGMENTATION_OUTPUT_KEY, MapSegmentation
+from tasks.segmentation.entities import (
+    SEGMENTATION_OUTPUT_KEY,
+    SEGMENT_MAP_CLASS,
+    MapSegmentation,
+)
 from tasks.text_extraction.entities import (
     DocTextExtraction,
     TextExtraction,
@@ -30,7 +39,7 @@ from tasks.text_extraction.entities import (
 )
 from tasks.common.pipeline import Task
 from shapely import Polygon
-from typing import Callable, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type
 import hashlib
 import requests
 
@@ -41,6 +50,10 @@ METADATA_EXTRACT_VER = "0.0.2"
 
 DEFAULT_OPENAI_API_VERSION = "2024-10-21"
 DEFAULT_GPT_MODEL = "gpt-4o"
+# point location extraction is a simpler structured task that is handled by a cheaper model when it
+# is requested on its own - this is only the fallback path, since point locations are normally
+# extracted along with the metadata by the main model
+DEFAULT_LOCATIONS_GPT_MODEL = "gpt-4o-mini"
 
 
 class LLM_PROVIDER(str, Enum):
@@ -51,6 +64,47 @@ class LLM_PROVIDER(str, Enum):
         return self.value
 
 
+# chat models (and their underlying http connection pools) shared across task instances
+_chat_models: Dict[Tuple[str, str, str], BaseChatModel] = {}
+
+
+def get_chat_model(
+    provider: LLM_PROVIDER, model: str, model_api_version: str
+) -> BaseChatModel:
+    """
+    Gets the chat model for the provider and model, creating it on first use so that all tasks in
+    the process share a single client and its connection pool.
+
+    Args:
+        provider (LLM_PROVIDER): The LLM provider.
+        model (str): The name of the model.
+        model_api_version (str): The API version, used by the Azure provider only.
+
+    Returns:
+        BaseChatModel: The shared chat model.
+    """
+    key = (str(provider), model, model_api_version)
+    if key not in _chat_models:
+        if provider == LLM_PROVIDER.AZURE:
+            # auto reads AZURE_CHAT_API_KEY,
+            _chat_models[key] = AzureChatOpenAI(
+                model=model, temperature=0.1, api_version=model_api_version
+            )
+        else:
+            # auto reads OPEN_AI_API_KEY from environment
+            # doesn't accept api version as an arg
+            _chat_models[key] = ChatOpenAI(model=model, temperature=0.1)
+    return _chat_models[key]
+
+
+@lru_cache(maxsize=4)
+def get_encoding(encoding_name: str) -> tiktoken.Encoding:
+    """
+    Gets the tiktoken encoding, loading the BPE tables only once per process.
+    """
+    return tiktoken.get_encoding(encoding_name)
+
+
 class MetdataLLM(BaseModel):
     """
     Metadata extraction output structure that is populated by the LLM.  LangChain generates the prommpt from this
@@ -177,6 +231,15 @@ class PointLocationsLLM(BaseModel):
     )
 
 
+class MetadataPointLocationsLLM(MetdataLLM, PointLocationsLLM):
+    """
+    Combined metadata and point locations output structure, allowing both to be extracted from the
+    map text with a single LLM request.
+    """
+
+    pass
+
+
 @dataclass
 class PointLocations:
     places: List[TextExtraction]
@@ -220,8 +283,8 @@ class CRSLLM(BaseModel):
 
 
 class MetadataExtractor(Task):
-    # matcher for alphanumeric strings
-    ALPHANUMERIC_PATTERN = re.compile(r".*[a-zA-Z].*\d.*|.*\d.*[a-zA-Z].*|.*[a-zA-Z].*")
+    # letters an OCR string must contain to be considered as metadata text
+    TEXT_FILTER_LETTERS = frozenset(string.ascii_letters)
 
     # patterns for scale normalization
     SCALE_PATTERN = re.compile(r"[,\. a-zA-z]+")
@@ -230,14 +293,33 @@ class MetadataExtractor(Task):
     # quadrangle normalization
     QUADRANGLE_PATTERN = re.compile(re.escape("quadrangle"), re.IGNORECASE)
 
+    # expected format of a CRS returned by the LLM
+    EPSG_PATTERN = re.compile(r"EPSG:\d+")
+
+    # markdown code fence the LLM may wrap around a JSON response
+    JSON_FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.DOTALL)
+
+    # max attempts for an llm request that is rate limited or times out
+    LLM_MAX_ATTEMPTS = 5
+
+    # encoding used for counting prompt and response tokens
+    TOKEN_ENCODING = "cl100k_base"
+
     # max number of tokens allowed by openai api, leaving enough for output
     TOKEN_LIMIT = 3500
 
+    # max number of tokens for the point location candidates sent with the metadata text
+    POINTS_TOKEN_LIMIT = 1500
+
     # OCR text filtering control
     MAX_TEXT_FILTER_LENGTH = 600
     MIN_TEXT_FILTER_LENGTH = 100
+
     TEXT_FILTER_DECREMENT = 100
 
+    # min number of words in the filtered OCR text for an LLM request to be worth making
+    MIN_TEXT_WORDS = 4
+
     TEXT_EXTRACT_TEMPLATE = (
         "The following blocks of text were extracted from a map using an OCR process:\n"
         + "{text_str}"
@@ -248,6 +330,21 @@ class MetadataExtractor(Task):
         + 'If any string value is not present the field should be set to "NULL"\n'
     )
 
+    TEXT_AND_POINT_LOCATIONS_TEMPLATE = (
+        "The following blocks of text were extracted from a map using an OCR process:\n"
+        + "{text_str}"
+        + "\n\n"
+        + "The following blocks of text were extracted from the map area using an OCR process, specified "
+        + "as a list of tuples with (text, index):\n"
+        + "{points_str}"
+        + "\n\n"
+        + "Extract metadata defined in the output structure from the first blocks of text, and extract the "
+        + "places that are map point features and population centers from the second blocks of text.\n"
+        + "{format}"
+        + "\n"
+        + 'If any string value is not present the field should be set to "NULL"\n'
+    )
+
     POINT_LOCATIONS_TEMPLATE = (
         "The following blocks of text were extracted from a map using an OCR process, specified "
         + "as a list of tuples with (text, index):\n"
@@ -303,6 +400,30 @@ class MetadataExtractor(Task):
         + "{format}"
     )
 
+    # point location candidate prefiltering - candidates are capitalized text containing letters that
+    # isn't a common map annotation word, and the LLM is skipped if too few candidates remain
+    MAX_PLACE_CANDIDATE_LENGTH = 40
+    MIN_PLACE_CANDIDATES = 2
+    PLACE_STOPWORDS = {
+        "figure",
+        "table",
+        "scale",
+        "north",
+        "south",
+        "east",
+        "west",
+        "legend",
+        "explanation",
+        "contour interval",
+        "miles",
+        "kilometers",
+        "feet",
+        "meters",
+    }
+
+    # number of computed map colour levels retained for reruns of the same raster
+    COLOR_LEVEL_CACHE_SIZE = 64
+
     # threshold for determining map shape - anything above is considered rectangular
     RECTANGULARITY_THRESHOLD = 0.9
 
@@ -312,6 +433,7 @@ class MetadataExtractor(Task):
         model=DEFAULT_GPT_MODEL,
         model_api_version=DEFAULT_OPENAI_API_VERSION,
         provider=LLM_PROVIDER.OPENAI,
+        locations_model: Optional[str] = None,
         text_key=TEXT_EXTRACTION_OUTPUT_KEY,
         should_run: Optional[Callable] = None,
         cache_location: str = "",
@@ -320,32 +442,68 @@ class MetadataExtractor(Task):
     ):
         super().__init__(id, cache_location)
 
-        if provider == LLM_PROVIDER.AZURE:
-            # auto reads AZURE_CHAT_API_KEY,
-            self._chat_model = AzureChatOpenAI(
-                model=model, temperature=0.1, api_version=model_api_version
+        # azure deployments are configured per-resource, so the cheaper locations model is only
+        # defaulted for openai - on azure the main model's deployment is used unless one is given
+        if locations_model is None:
+            locations_model = (
+                model if provider == LLM_PROVIDER.AZURE else DEFAULT_LOCATIONS_GPT_MODEL
             )
-        else:
-            # auto reads OPEN_AI_API_KEY from environment
-            # doesn't accept api version as an arg
-            self._chat_model = ChatOpenAI(model=model, temperature=0.1)
+
+        self._chat_model = get_chat_model(provider, model, model_api_version)
+        self._locations_chat_model = get_chat_model(
+            provider, locations_model, model_api_version
+        )
 
         self._model = model
+        self._locations_model = locations_model
         self._text_key = text_key
         self._include_place_bounds = include_place_bounds
         self._should_run = should_run
         self._metrics_url = metrics_url
+        self._encoding = get_encoding(self.TOKEN_ENCODING)
+        self._color_levels: Dict[Tuple[str, Tuple[int, int]], MapColorType] = {}
+
+        # prompt templates and chains are static for the lifetime of the task, so build them once
+        self._metadata_prompt, self._metadata_chain = self._build_chain(
+            MetdataLLM, self.TEXT_EXTRACT_TEMPLATE
+        )
+        self._metadata_locations_prompt, self._metadata_locations_chain = (
+            self._build_chain(
+                MetadataPointLocationsLLM, self.TEXT_AND_POINT_LOCATIONS_TEMPLATE
+            )
+        )
+        # only used when point locations weren't extracted along with the metadata
+        _, self._point_locations_chain = self._build_chain(
+            PointLocationsLLM,
+            self.POINT_LOCATIONS_TEMPLATE,
+            self._locations_chat_model,
+        )
+        _, self._state_country_chain = self._build_chain(
+            StateCountryLLM, self.STATE_COUNTRY_TEMPLATE
+        )
+        _, self._utm_zone_chain = self._build_chain(UTMZoneLLM, self.UTM_ZONE_TEMPLATE)
+        _, self._quadrangles_chain = self._build_chain(
+            QuadranglesLLM, self.QUADRANGLES_TEMPLATE
+        )
+        _, self._crs_chain = self._build_chain(CRSLLM, self.CRS_TEMPLATE)
 
         # validate llm connection parameters
         try:
             self._chat_model.invoke([SystemMessage(content="validate my API key")])
+            if locations_model != model:
+                # (also confirms that the locations model / deployment exists)
+                self._locations_chat_model.invoke(
+                    [SystemMessage(content="validate my API key")]
+                )
         except Exception as e:
             logger.error(
                 f"LLM api validation for {self._model} from {provider} failed with error: {repr(e)}."
             )
             sys.exit(1)
 
-        logger.info(f"Using model: {self._model} from provider {provider.value}")
+        logger.info(
+            f"Using model: {self._model} (locations: {self._locations_model}) from provider {provider.value}"
+        )
 
     def run(self, input: TaskInput) -> TaskResult:
         """
@@ -388,56 +546,44 @@ class MetadataExtractor(Task):
         metadata: Optional[MetadataExtraction] = input.parse_data(
             METADATA_EXTRACTION_OUTPUT_KEY, MetadataExtraction.model_validate
         )
-        if metadata is None:
-            metadata = self._process_doc_text_extraction(doc_text)
 
-        if metadata:
-            logger.info("Post-processing metadata extraction result")
-
-            # normalize scale
-            metadata.scale = self._normalize_scale(metadata.scale)
-
-            # get the map region-of-interest, if available
-            map_roi = input.parse_data(ROI_MAP_OUTPUT_KEY, MapROI.model_validate)
-            map_text = self._roi_filtering(doc_text.extractions, map_roi)
+        # get the map region-of-interest, if available, and the text within it that point-based
+        # places are extracted from
+        map_roi = input.parse_data(ROI_MAP_OUTPUT_KEY, MapROI.model_validate)
+        map_text = DocTextExtraction(
+            doc_id=input.raster_id,
+            extractions=self._roi_filtering(doc_text.extractions, map_roi),
+        )
 
-            # extract point-based places from map ROI
-            point_locations = self._extract_point_locations(
-                DocTextExtraction(doc_id=input.raster_id, extractions=map_text)
+        # extract the metadata and point locations together with a single request
+        point_locations: Optional[PointLocations] = None
+        if metadata is None:
+            metadata, point_locations = self._process_doc_text_extraction(
+                doc_text, map_text
             )
-            if not self._include_place_bounds:
-                metadata.places = [p.text for p in point_locations.places]
-                metadata.population_centres = [
-                    p.text for p in point_locations.population_centers
-                ]
-            else:
-                metadata.places = point_locations.places
-                metadata.population_centres = point_locations.population_centers
-
-            # extract state and country if not present in metadata after initial extraction
-            if not metadata.states or metadata.country == "NULL":
-                metadata.states, metadata.country = self._extract_state_country(
-                    metadata
-                )
 
-            # extract quadrangles
-            metadata.quadrangles = self._extract_quadrangles(metadata)
-
-            # extract UTM zone if not present in metadata after initial extraction
-            if int(metadata.utm_zone) == 0:
-                metadata.utm_zone = str(self._extract_utm_zone(metadata))
-
-            if not metadata.crs or metadata.crs == "NULL":
-                crs = self._extract_crs(metadata)
-                metadata.crs = crs
-            logger.info(f"Extracted CRS: {metadata.crs}")
+        if metadata and self._is_empty_extraction(metadata):
+            # nothing was extracted (too little text, or the request failed) so there is nothing
+            # to post-process - the empty result isn't cached so the map is retried on a rerun
+            logger.warning(f"Empty metadata extraction result for {doc_id}")
+            task_result.add_output(
+                METADATA_EXTRACTION_OUTPUT_KEY, metadata.model_dump()
+            )
+            return task_result
 
-            # compute map shape from the segmentation output
+        if metadata:
+            # the map shape and colour level are CPU bound (and OpenCV releases the GIL) so they
+            # are computed in the background while the follow on LLM requests are in flight
             segments = input.data.get(SEGMENTATION_OUTPUT_KEY, None)
-            metadata.map_shape = self._compute_shape(segments)
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                shape_future = executor.submit(self._compute_shape, segments)
+                color_future = executor.submit(self._get_color_level, input)
+
+                self._post_process_metadata(metadata, map_text, point_locations)
 
-            # compute map chroma from the image
-            metadata.map_color = self._compute_color_level(input.image)
+                # collect map shape and chroma computed from the segmentation output and image
+                metadata.map_shape = shape_future.result()
+                metadata.map_color = color_future.result()
 
             # update the cache
             self.write_result_to_cache(metadata, doc_id)
@@ -450,6 +596,55 @@ class MetadataExtractor(Task):
 
         return task_result
 
+    def _post_process_metadata(
+        self,
+        metadata: MetadataExtraction,
+        map_text: DocTextExtraction,
+        point_locations: Optional[PointLocations],
+    ):
+        """
+        Normalizes the extracted metadata and fills in the fields that are populated by follow on
+        LLM requests.  The metadata is updated in place.
+
+        Args:
+            metadata (MetadataExtraction): The metadata extracted from the map text
+            map_text (DocTextExtraction): The text extraction from the map area
+            point_locations (Optional[PointLocations]): The point locations, if they were extracted
+                with the metadata
+        """
+        logger.info("Post-processing metadata extraction result")
+
+        # normalize scale
+        metadata.scale = self._normalize_scale(metadata.scale)
+
+        # extract point-based places from map ROI if not done with the metadata
+        if point_locations is None:
+            point_locations = self._extract_point_locations(map_text)
+        if not self._include_place_bounds:
+            metadata.places = [p.text for p in point_locations.places]
+            metadata.population_centres = [
+                p.text for p in point_locations.population_centers
+            ]
+        else:
+            metadata.places = point_locations.places
+            metadata.population_centres = point_locations.population_centers
+
+        # extract state and country if not present in metadata after initial extraction
+        if not metadata.states or metadata.country == "NULL":
+            metadata.states, metadata.country = self._extract_state_country(metadata)
+
+        # extract quadrangles
+        metadata.quadrangles = self._extract_quadrangles(metadata)
+
+        # extract UTM zone if not present in metadata after initial extraction
+        if int(metadata.utm_zone) == 0:
+            metadata.utm_zone = str(self._extract_utm_zone(metadata))
+
+        if not metadata.crs or metadata.crs == "NULL":
+            crs = self._extract_crs(metadata)
+            metadata.crs = crs
+        logger.info(f"Extracted CRS: {metadata.crs}")
+
     def _generate_doc_key(
         self, task_input: TaskInput, doc_text: DocTextExtraction
     ) -> str:
@@ -468,6 +663,7 @@ class MetadataExtractor(Task):
                 METADATA_EXTRACT_VER,
                 task_input.raster_id,
                 self._model,
+                self._locations_model,
                 str(self._include_place_bounds),
                 doc_text.model_dump_json(),
             ]
@@ -476,16 +672,21 @@ class MetadataExtractor(Task):
         return f"{task_input.raster_id}_{doc_key}"
 
     def _process_doc_text_extraction(
-        self, doc_text_extraction: DocTextExtraction
-    ) -> Optional[MetadataExtraction]:
+        self,
+        doc_text_extraction: DocTextExtraction,
+        map_text: Optional[DocTextExtraction] = None,
+    ) -> Tuple[Optional[MetadataExtraction], Optional[PointLocations]]:
         """
-        Processes the text extraction from the OCR output and extracts metadata from it using an LLM .
+        Processes the text extraction from the OCR output and extracts metadata from it using an LLM.  If
+        map text is supplied, point locations are extracted from it as part of the same request.
 
         Args:
             doc_text_extraction (DocTextExtraction): The text extraction from the OCR output
+            map_text (Optional[DocTextExtraction]): The text extraction from the map area
 
         Returns:
-            Optional[MetadataExtraction]: The extracted metadata
+            Tuple[Optional[MetadataExtraction], Optional[PointLocations]]: The extracted metadata, and the
+                extracted point locations or None if they were not extracted
         """
 
         try:
@@ -493,34 +694,61 @@ class MetadataExtractor(Task):
                 f"Processing doc text extractions from '{doc_text_extraction.doc_id}'"
             )
 
+            # skip the request entirely when there is too little text to extract metadata from
+            if not self._has_min_text(doc_text_extraction):
+                logger.info(
+                    f"Skipping extraction '{doc_text_extraction.doc_id}' - insufficient text"
+                )
+                return self._create_empty_extraction(doc_text_extraction.doc_id), None
+
+            # include point location extraction in the request when there are candidates
+            candidates = self._prefilter_place_candidates(map_text) if map_text else []
+            extract_locations = len(candidates) >= self.MIN_PLACE_CANDIDATES
+            token_limit = self.TOKEN_LIMIT
+            if extract_locations:
+                prompt_template = self._metadata_locations_prompt
+                chain = self._metadata_locations_chain
+                # the candidates have their own token budget, so a long candidate list can't
+                # crowd the metadata text out of the prompt
+                points_str = self._build_indexed_text(
+                    candidates, self.POINTS_TOKEN_LIMIT
+                )
+                prompt_args = {"points_str": points_str}
+                token_limit += self._count_tokens(points_str)
+            else:
+                prompt_template = self._metadata_prompt
+                chain = self._metadata_chain
+                prompt_args = {}
+
             max_text_length = self.MAX_TEXT_FILTER_LENGTH
             num_tokens = 0
 
-            input_prompt: Optional[PromptValue] = None
-            text = []
-
-            # setup the output structure
-            parser = PydanticOutputParser(pydantic_object=MetdataLLM)
+            # read the OCR strings out of the extraction models once, rather than on every
+            # pass of the token limit loop
+            texts = [text_entry.text for text_entry in doc_text_extraction.extractions]
 
-            # setup the prompt template
-            prompt_template = self._generate_prompt_template(
-                parser, self.TEXT_EXTRACT_TEMPLATE
-            )
+            input_prompt: Optional[PromptValue] = None
+            text_str = ""
 
             while max_text_length > self.MIN_TEXT_FILTER_LENGTH:
                 # extract text from OCR output using rule-based filtering
-                text = self._extract_text(doc_text_extraction, max_text_length)
-                input_prompt = prompt_template.format_prompt(text_str="\n".join(text))
+                text_str = "\n".join(self._extract_text(texts, max_text_length))
+                input_prompt = prompt_template.format_prompt(
+                    text_str=text_str, **prompt_args
+                )
                 if input_prompt is None:
                     logger.warning(
                         f"Skipping extraction '{doc_text_extraction.doc_id}' - prompt generation failed"
                     )
-                    return self._create_empty_extraction(doc_text_extraction.doc_id)
+                    return (
+                        self._create_empty_extraction(doc_text_extraction.doc_id),
+                        None,
+                    )
 
                 # if the token count is greater than the limit, reduce the max text length
                 # and try again
                 num_tokens = self._count_tokens(input_prompt.to_string())
-                if num_tokens <= self.TOKEN_LIMIT:
+                if num_tokens <= token_limit:
                     break
                 max_text_length = max_text_length - self.TEXT_FILTER_DECREMENT
                 logger.debug(
@@ -535,38 +763,54 @@ class MetadataExtractor(Task):
             if input_prompt is not None:
                 logger.debug("Prompt string:\n")
                 logger.debug(input_prompt.to_string())
-                chain = prompt_template | self._chat_model | parser
-                response = chain.invoke({"text_str": "\n".join(text)})
+                response = chain.invoke({"text_str": text_str, **prompt_args})
 
                 # publish output token counts to metrics service
-                output_tokens = self._count_tokens(response.json())
+                output_tokens = self._count_tokens(response.model_dump_json())
                 logger.info(f"Response generated {output_tokens} tokens.")
 
                 self._publish_output_metrics(output_tokens)
 
                 # add placeholders for fields we don't extract
-                response_dict = response.dict()
+                response_dict = response.model_dump(
+                    exclude={"places", "population_centers"}
+                )
                 response_dict["quadrangles"] = []
                 response_dict["population_centres"] = []
                 response_dict["places"] = []
                 response_dict["map_shape"] = "unknown"
                 response_dict["map_color"] = "unknown"
 
-                return MetadataExtraction(
+                metadata = MetadataExtraction(
                     map_id=doc_text_extraction.doc_id, **response_dict
                 )
+            else:
+                logger.warning(
+                    f"Skipping extraction '{doc_text_extraction.doc_id}' - input token count {num_tokens} is greater than limit {token_limit}"
+                )
+                return self._create_empty_extraction(doc_text_extraction.doc_id), None
 
-            logger.warning(
-                f"Skipping extraction '{doc_text_extraction.doc_id}' - input token count {num_tokens} is greater than limit {self.TOKEN_LIMIT}"
-            )
-            return self._create_empty_extraction(doc_text_extraction.doc_id)
-
-        except Exception as e:
+        except Exception:
             logger.error(
                 f"Skipping extraction '{doc_text_extraction.doc_id}' - unexpected error during processing",
                 exc_info=True,
             )
-            return self._create_empty_extraction(doc_text_extraction.doc_id)
+            return self._create_empty_extraction(doc_text_extraction.doc_id), None
+
+        # map the point locations back to their text extractions - done outside of the request
+        # error handling so that a bad location index can't discard the metadata
+        point_locations: Optional[PointLocations] = None
+        if map_text is not None:
+            point_locations = PointLocations(places=[], population_centers=[])
+            if extract_locations:
+                point_locations = PointLocations(
+                    places=self._map_text_coordinates(response.places, map_text, True),
+                    population_centers=self._map_text_coordinates(
+                        response.population_centers, map_text, True
+                    ),
+                )
+
+        return metadata, point_locations
 
     def _roi_filtering(
         self, text_extractions: List[TextExtraction], map_roi: Optional[MapROI]
@@ -605,16 +849,18 @@ class MetadataExtractor(Task):
         Returns:
             List[TextExtraction]: A list of extracted locations as TextExtraction objects.
         """
-        logger.info(f"Secondary extraction of point locations")
+        logger.info("Secondary extraction of point locations")
 
-        text_indices = self._extract_text_with_index(doc_text)
+        text_indices = self._prefilter_place_candidates(doc_text)
+        if len(text_indices) < self.MIN_PLACE_CANDIDATES:
+            logger.info(
+                f"Only {len(text_indices)} point location candidates found - skipping LLM extraction"
+            )
+            return PointLocations(places=[], population_centers=[])
 
-        parser = PydanticOutputParser(pydantic_object=PointLocationsLLM)
-        prompt_template = self._generate_prompt_template(
-            parser, self.POINT_LOCATIONS_TEMPLATE
+        response: PointLocationsLLM = self._point_locations_chain.invoke(
+            {"text_str": self._build_indexed_text(text_indices)}
         )
-        chain = prompt_template | self._chat_model | parser
-        response: PointLocationsLLM = chain.invoke({"text_str": text_indices})
 
         places = self._map_text_coordinates(response.places, doc_text, True)
         population_centers = self._map_text_coordinates(
@@ -636,12 +882,7 @@ class MetadataExtractor(Task):
         """
         logger.info("Secondary extraction of state/country")
 
-        parser = PydanticOutputParser(pydantic_object=StateCountryLLM)
-        prompt_template = self._generate_prompt_template(
-            parser, self.STATE_COUNTRY_TEMPLATE
-        )
-        chain = prompt_template | self._chat_model | parser
-        response: StateCountryLLM = chain.invoke(
+        response: StateCountryLLM = self._state_country_chain.invoke(
             {
                 "places": " ".join(
                     [
@@ -672,7 +913,7 @@ class MetadataExtractor(Task):
         Returns:
             int: The UTM zone extracted from the metadata. 0 indicates that the UTM zone could not be inferred.
         """
-        logger.info(f"Secondary extraction of UTM zone")
+        logger.info("Secondary extraction of UTM zone")
 
         args = {
             "coordinate_systems": ",".join(metadata.coordinate_systems),
@@ -691,10 +932,7 @@ class MetadataExtractor(Task):
                 for s in metadata.population_centres
             ),
         }
-        parser = PydanticOutputParser(pydantic_object=UTMZoneLLM)
-        prompt_template = self._generate_prompt_template(parser, self.UTM_ZONE_TEMPLATE)
-        chain = prompt_template | self._chat_model | parser
-        response = chain.invoke(args)
+        response = self._utm_zone_chain.invoke(args)
         return response.utm_zone
 
     def _extract_quadrangles(self, metadata: MetadataExtraction) -> List[str]:
@@ -707,16 +945,11 @@ class MetadataExtractor(Task):
         Returns:
             List[str]: A list of extracted quadrangles.
         """
-        logger.info(f"Secondary extraction of quadrangles")
+        logger.info("Secondary extraction of quadrangles")
 
         args = {"title": metadata.title, "base_map": metadata.base_map}
 
-        parser = PydanticOutputParser(pydantic_object=QuadranglesLLM)
-        prompt_template = self._generate_prompt_template(
-            parser, self.QUADRANGLES_TEMPLATE
-        )
-        chain = prompt_template | self._chat_model | parser
-        response = chain.invoke(args)
+        response = self._quadrangles_chain.invoke(args)
 
         return self._normalize_quadrangles(response.quadrangles)
 
@@ -730,7 +963,7 @@ class MetadataExtractor(Task):
         Returns:
             str: The extracted CRS.
         """
-        logger.info(f"Secondary extraction of CRS")
+        logger.info("Secondary extraction of CRS")
 
         args = {
             "country": metadata.country,
@@ -742,46 +975,69 @@ class MetadataExtractor(Task):
             "utm_zone": metadata.utm_zone,
         }
 
-        parser = PydanticOutputParser(pydantic_object=CRSLLM)
-        prompt_template = self._generate_prompt_template(parser, self.CRS_TEMPLATE)
-        chain = prompt_template | self._chat_model | parser
-        response = chain.invoke(args)
+        response = self._crs_chain.invoke(args)
 
         # validate the returned CRS to ensure it follows the EPSG format
-        if not re.match(r"EPSG:\d+", response.crs):
+        if not self.EPSG_PATTERN.match(response.crs):
             logger.warning(
                 f"CRS returned from LLM does not follow EPSG format: {response.crs}"
             )
             return "NULL"
         return response.crs
 
-    def _extract_text_with_index(
+    def _prefilter_place_candidates(
         self, doc_text_extraction: DocTextExtraction
     ) -> List[Tuple[str, int]]:
         """
-        Extracts the text from the given `doc_text_extraction` object along with their respective indices.
+        Applies a cheap lexical filter to the text extractions to drop entries that can't be place names
+        before they are sent to the LLM.  Candidates are kept with their index in the original extractions.
 
         Args:
             doc_text_extraction (DocTextExtraction): The `DocTextExtraction` object containing the text extractions.
 
         Returns:
-            List[Tuple[str, int]]: A list of tuples where each tuple contains the extracted text and its index.
+            List[Tuple[str, int]]: A list of tuples where each tuple contains a candidate text and its index.
         """
-        # map all text with index
-        return [(d.text, i) for i, d in enumerate(doc_text_extraction.extractions)]
+        candidates = []
+        for i, d in enumerate(doc_text_extraction.extractions):
+            text = d.text.strip()
+            if (
+                text
+                and len(text) <= self.MAX_PLACE_CANDIDATE_LENGTH
+                and text[0].isupper()
+                and any(c.isalpha() for c in text)
+                and text.lower() not in self.PLACE_STOPWORDS
+            ):
+                candidates.append((d.text, i))
+        return candidates
 
-    def _text_extractions_to_str(self, extractions: List[Tuple[str, int]]) -> str:
+    def _build_indexed_text(
+        self, candidates: List[Tuple[str, int]], token_limit: Optional[int] = None
+    ) -> str:
         """
-        Converts a list of text extractions to a string representation.
+        Builds the prompt string for a list of indexed text candidates in a single pass.
 
         Args:
-            extractions (List[Tuple[str, int]]): A list of tuples containing the extracted text and its coordinate.
+            candidates (List[Tuple[str, int]]): A list of tuples containing the extracted text and its index.
+            token_limit (Optional[int]): If set, candidates are dropped from the end of the list once
+                the string would exceed this many tokens.
 
         Returns:
-            str: A string representation of the text extractions, with each entry on a new line.
+            str: A string representation of the candidates, with each (text, index) entry on a new line.
         """
-        items = [f"({r[0]}, {i})" for i, r in enumerate(extractions)]
-        return "\n".join(items)
+        lines = [f"({text}, {i})" for text, i in candidates]
+        if token_limit is not None:
+            num_tokens = 0
+            for num_lines, line in enumerate(lines):
+                # (+1 for the newline separator)
+                num_tokens += self._count_tokens(line) + 1
+                if num_tokens > token_limit:
+                    logger.info(
+                        f"Truncating point location candidates from {len(lines)} to {num_lines} to fit token limit"
+                    )
+                    lines = lines[:num_lines]
+                    break
+        return "\n".join(lines)
 
     def _map_text_coordinates(
         self,
@@ -803,29 +1059,35 @@ class MetadataExtractor(Task):
         """
         # want to use the index to filter the extractions
         # TODO: MAY WANT TO CHECK THE TEXT LINES UP JUST IN CASE THE LLM HAD A BIT OF FUN
-        filtered = []
+        # shallow copy - only the text field is replaced, bounds are shared with the source
+        num_extractions = len(extractions.extractions)
+        mapped = []
         for p in places:
-            e = copy.deepcopy(extractions.extractions[p.index])
-            if replace_text:
-                e.text = p.name
-            filtered.append(e)
-        return filtered  # type: ignore
+            # the LLM can return indices that weren't in the prompt - drop them
+            if p.index < 0 or p.index >= num_extractions:
+                logger.warning(
+                    f"Dropping place '{p.name}' with invalid text index {p.index}"
+                )
+                continue
+            mapped.append(
+                extractions.extractions[p.index].model_copy(
+                    update={"text": p.name} if replace_text else None
+                )
+            )
+        return mapped
 
-    def _count_tokens(self, input_str: str, encoding_name="cl100k_base") -> int:
+    def _count_tokens(self, input_str: str) -> int:
         """
-        Counts the number of tokens in the input string using the specified encoding.
+        Counts the number of tokens in the input string using the task's token encoding.
 
         Args:
             input_str (str): The input string to count tokens from.
-            encoding_name (str): The name of the encoding to use.
 
         Returns:
             int: The number of tokens in the input string.
 
         """
-        encoding = tiktoken.get_encoding(encoding_name)
-        num_tokens = len(encoding.encode(input_str))
-        return num_tokens
+        return len(self._encoding.encode(input_str))
 
     def _publish_input_metrics(self, num_tokens: int):
         """
@@ -859,6 +1121,35 @@ class MetadataExtractor(Task):
                 self._metrics_url + "/gauge/output_tokens?value=" + str(num_tokens)
             )
 
+    def _build_chain(
+        self,
+        model: Type[BaseModel],
+        template: str,
+        chat_model: Optional[BaseChatModel] = None,
+    ) -> Tuple[ChatPromptTemplate, Runnable]:
+        """
+        Builds the prompt template and the prompt -> LLM -> parser chain for an output structure.
+
+        Args:
+            model (Type[BaseModel]): The pydantic model defining the LLM output structure.
+            template (str): The template string for the human message.
+            chat_model (Optional[BaseChatModel]): The chat model to use, defaults to the task's chat model.
+
+        Returns:
+            Tuple[ChatPromptTemplate, Runnable]: The prompt template and the chain that uses it.
+        """
+        parser = PydanticOutputParser(pydantic_object=model)
+        prompt_template = self._generate_prompt_template(parser, template)
+        chat_model = chat_model if chat_model else self._chat_model
+        # back off and retry when requests are rate limited or time out
+        retrying_chat_model = chat_model.with_retry(
+            retry_if_exception_type=(openai.RateLimitError, openai.APITimeoutError),
+            wait_exponential_jitter=True,
+            stop_after_attempt=self.LLM_MAX_ATTEMPTS,
+        )
+        chain = prompt_template | retrying_chat_model | self._json_output_parser(model)
+        return prompt_template, chain
+
     def _generate_prompt_template(self, parser, template: str) -> ChatPromptTemplate:
         """
         Generates a chat prompt template from an input string.
@@ -882,31 +1173,96 @@ class MetadataExtractor(Task):
         )
         return prompt
 
-    def _extract_text(
-        self, doc_text_extraction: DocTextExtraction, max_text_length=800
-    ) -> List[str]:
+    def _json_output_parser(self, model: Type[BaseModel]) -> RunnableLambda:
+        """
+        Creates a runnable that validates the LLM response directly against a pydantic model
+        using pydantic's native JSON parser, avoiding a separate json.loads and validation pass.
+
+        Args:
+            model (Type[BaseModel]): The pydantic model the response is validated against.
+
+        Returns:
+            RunnableLambda: A runnable mapping the LLM message to the validated model.
+        """
+
+        def parse(message: BaseMessage) -> BaseModel:
+            content = str(message.content).strip()
+            fenced = self.JSON_FENCE_PATTERN.search(content)
+            if fenced:
+                content = fenced.group(1)
+            else:
+                # the LLM may wrap the JSON in prose (eg. "Here is the result: {...}"), so fall
+                # back to the outermost object in the response
+                start = content.find("{")
+                end = content.rfind("}")
+                if start != -1 and end > start:
+                    content = content[start : end + 1]
+            return model.model_validate_json(content)
+
+        return RunnableLambda(parse)
+
+    def _extract_text(self, texts: Iterable[str], max_text_length=800) -> Iterator[str]:
         """
         Extracts text from OCR output - filters to alphanumeric strings between 4 and 400 characters long
-        that contain at least one space
+        that contain at least one space.  The text is generated lazily so that it can be streamed
+        directly into the prompt string.
 
         Args:
-            doc_text_extraction (DocTextExtraction): The text extraction from the OCR output
+            texts (Iterable[str]): The OCR text strings, read from the extractions up front
             max_text_length (int): The maximum length of the text to extract
 
         Returns:
-            List[str]: The extracted text
+            Iterator[str]: The extracted text
         """
-        text_dims = []
-        for text_entry in doc_text_extraction.extractions:
-            text = text_entry.text
-            if (
-                self.ALPHANUMERIC_PATTERN.match(text)
-                and len(text) >= 4
-                and len(text) <= max_text_length
-                and len(text.split(" ")) > 1
-            ):
-                text_dims.append(text)
-        return text_dims
+        is_candidate_text = self._is_candidate_text
+        return (text for text in texts if is_candidate_text(text, max_text_length))
+
+    def _has_min_text(self, doc_text_extraction: DocTextExtraction) -> bool:
+        """
+        Checks if the filtered OCR text contains enough words to be worth an LLM request - a cheap
+        check made before any prompt is generated or tokenized.
+
+        Args:
+            doc_text_extraction (DocTextExtraction): The text extraction from the OCR output
+
+        Returns:
+            bool: True if there is enough text, False otherwise
+        """
+        num_words = 0
+        for text in self._extract_text(
+            (text_entry.text for text_entry in doc_text_extraction.extractions),
+            self.MAX_TEXT_FILTER_LENGTH,
+        ):
+            num_words += len(text.split())
+            if num_words >= self.MIN_TEXT_WORDS:
+                return True
+        return False
+
+    def _is_candidate_text(self, text: str, max_text_length: int) -> bool:
+        """
+        Checks if an OCR string should be included in the metadata text - the string must be between 4
+        and max_text_length characters long, and contain at least one letter and one space.  The letter
+        and space checks are done in a single pass that stops as soon as both are found.
+
+        Args:
+            text (str): The OCR string
+            max_text_length (int): The maximum length of the string
+
+        Returns:
+            bool: True if the string should be included, False otherwise
+        """
+        if len(text) < 4 or len(text) > max_text_length:
+            return False
+        has_letter = False
+        has_space = False
+        for c in text:
+            if c in self.TEXT_FILTER_LETTERS:
+                has_letter = True
+            elif c == " ":
+                has_space = True
+            if has_letter and has_space:
+                return True
+        return False
 
     def _normalize_scale(self, scale_str: str) -> str:
         """
@@ -919,8 +1275,8 @@ class MetadataExtractor(Task):
             str: The normalized scale string
         """
         if scale_str != "NULL":
-            normalized_scale = re.sub(self.SCALE_PATTERN, "", scale_str)
-            if not re.match(self.SCALE_PREPEND, normalized_scale):
+            normalized_scale = self.SCALE_PATTERN.sub("", scale_str)
+            if not self.SCALE_PREPEND.match(normalized_scale):
                 normalized_scale = "1:" + normalized_scale
             return normalized_scale
         return scale_str
@@ -936,7 +1292,7 @@ class MetadataExtractor(Task):
             List[str]: The normalized quadrangle strings
         """
         return [
-            re.sub(self.QUADRANGLE_PATTERN, "", quad_str).strip()
+            self.QUADRANGLE_PATTERN.sub("", quad_str).strip()
             for quad_str in quadrangles_str
         ]
 
@@ -950,28 +1306,63 @@ class MetadataExtractor(Task):
         Returns:
             MapShape: The shape of the map
         """
-        map_shape = MapShape.UNKNOWN
-        if segments:
-            map_segmentation = MapSegmentation.model_validate(segments)
-            for segment in map_segmentation.segments:
-                if segment.class_label == "map":
-                    box_area = (segment.bbox[2] - segment.bbox[0]) * (
-                        segment.bbox[3] - segment.bbox[1]
-                    )
-                    rectangularity = segment.area / box_area
-                    if rectangularity > self.RECTANGULARITY_THRESHOLD:
-                        map_shape = MapShape.RECTANGULAR
-                    else:
-                        map_shape = MapShape.IRREGULAR
-                    break
-        return map_shape
+        if not segments:
+            return MapShape.UNKNOWN
+
+        map_segmentation = MapSegmentation.model_validate(segments)
+        map_segment = next(
+            (
+                s
+                for s in map_segmentation.segments
+                if s.class_label == SEGMENT_MAP_CLASS
+            ),
+            None,
+        )
+        if map_segment is None:
+            return MapShape.UNKNOWN
+
+        bbox = map_segment.bbox
+        box_area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+        if box_area <= 0:
+            return MapShape.UNKNOWN
+
+        rectangularity = map_segment.area / box_area
+        return (
+            MapShape.RECTANGULAR
+            if rectangularity > self.RECTANGULARITY_THRESHOLD
+            else MapShape.IRREGULAR
+        )
+
+    def _get_color_level(self, input: TaskInput) -> MapColorType:
+        """
+        Gets the colour level of the input map image, reusing the result computed for a previous
+        run on the same raster when available.
+
+        Args:
+            input (TaskInput): The task input containing the map image
+
+        Returns:
+            MapColorType: The chroma type of the map
+        """
+        if not input.raster_id:
+            return self._compute_color_level(input.image)
+
+        key = (input.raster_id, input.image.size)
+        color_level = self._color_levels.get(key)
+        if color_level is None:
+            color_level = self._compute_color_level(input.image)
+            if len(self._color_levels) >= self.COLOR_LEVEL_CACHE_SIZE:
+                # evict the oldest entry
+                self._color_levels.pop(next(iter(self._color_levels)))
+            self._color_levels[key] = color_level
+        return color_level
 
     def _compute_color_level(
         self, input_image: PILImage, max_dim=500, mono_thresh=20, low_thresh=60
     ) -> MapColorType:
         """
-        Computes the colour level of the map image using the LAB color space
-        and the centroid of the a and b channels
+        Computes the colour level of the map image using the variance of the a and b
+        channels in the LAB color space
 
         Args:
             input_image (PILImage): The map image
@@ -980,25 +1371,21 @@ class MetadataExtractor(Task):
         Returns:
             MapColorType: The chroma type of the map
         """
+        image = pil_to_cv_image(input_image)
         if max_dim > 0:
             # uniformly resize the image so that major axis is max_dim
-            image = pil_to_cv_image(input_image)
             h, w, _ = image.shape
             if h > w:
                 image = cv2.resize(image, (max_dim, int(h / w * max_dim)))
             else:
                 image = cv2.resize(image, (int(w / h * max_dim), max_dim))
 
-        # exract the a and b channels and find the centroid
+        # the mean squared distance of the a and b channels from their centroid is the sum of
+        # the channel variances, which meanStdDev computes in a single pass - statistics are
+        # taken over all three channels to avoid copying the non-contiguous a/b slice
         cs_image = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
-        cs_image = cs_image[:, :, 1:].flatten().reshape(-1, 2)
-
-        # compute the error between the mean and each pixel
-        mean_vec = np.sum(cs_image, axis=0) / len(cs_image)
-        dist = np.linalg.norm(cs_image - mean_vec, axis=1)
-
-        # square the distance and take the mean
-        error = np.mean(dist**2)
+        _, std = cv2.meanStdDev(cs_image)
+        error = float(std[1, 0] ** 2 + std[2, 0] ** 2)
 
         # classify the chroma based on the error
         if error < mono_thresh:
@@ -1008,6 +1395,11 @@ class MetadataExtractor(Task):
         else:
             return MapColorType.HIGH
 
+    @classmethod
+    def _is_empty_extraction(cls, metadata: MetadataExtraction) -> bool:
+        """Checks if a metadata extraction object is an empty extraction"""
+        return metadata == cls._create_empty_extraction(metadata.map_id)
+
     @staticmethod
     def _create_empty_extraction(doc_id: str) -> MetadataExtraction:
         """Creates an empty metadata extraction object"""
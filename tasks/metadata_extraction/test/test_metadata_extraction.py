@@ -0,0 +1,177 @@
+import json
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+import pytest
+from typing import List, Optional
+
+from tasks.metadata_extraction import metadata_extraction
+from tasks.metadata_extraction.metadata_extraction import (
+    DEFAULT_GPT_MODEL,
+    DEFAULT_LOCATIONS_GPT_MODEL,
+    LLM_PROVIDER,
+    Location,
+    MetadataExtractor,
+)
+from tasks.common.task import TaskInput
+from tasks.metadata_extraction.entities import (
+    METADATA_EXTRACTION_OUTPUT_KEY,
+    MetadataExtraction,
+)
+from tasks.text_extraction.entities import (
+    DocTextExtraction,
+    Point,
+    TextExtraction,
+    TEXT_EXTRACTION_OUTPUT_KEY,
+)
+
+
+class WordEncoding:
+    """Stands in for the tiktoken encoding - one token per word"""
+
+    def encode(self, text: str):
+        return text.split()
+
+
+def create_extractor(
+    monkeypatch, responses: Optional[List[str]] = None
+) -> MetadataExtractor:
+    # the first response is consumed by the api key validation at construction
+    chat_model = FakeListChatModel(responses=["ok"] + (responses or []))
+
+    def get_chat_model(provider, model, model_api_version):
+        if model == DEFAULT_GPT_MODEL:
+            return chat_model
+        return FakeListChatModel(responses=["ok"])
+
+    monkeypatch.setattr(metadata_extraction, "get_chat_model", get_chat_model)
+    monkeypatch.setattr(metadata_extraction, "get_encoding", lambda _: WordEncoding())
+    return MetadataExtractor("test-metadata")
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    return create_extractor(monkeypatch)
+
+
+def create_doc_text(texts) -> DocTextExtraction:
+    return DocTextExtraction(
+        doc_id="test",
+        extractions=[
+            TextExtraction(
+                text=text,
+                confidence=1.0,
+                bounds=[
+                    Point(x=i, y=0),
+                    Point(x=i + 1, y=0),
+                    Point(x=i + 1, y=1),
+                    Point(x=i, y=1),
+                ],
+            )
+            for i, text in enumerate(texts)
+        ],
+    )
+
+
+def test_map_text_coordinates_drops_invalid_indices(extractor):
+    doc_text = create_doc_text(["Bald Mountain", "Eagle Peak"])
+    places = [
+        Location(name="Eagle Peak", index=1),
+        Location(name="Made Up Hill", index=7),
+        Location(name="Unset", index=-1),
+    ]
+
+    mapped = extractor._map_text_coordinates(places, doc_text, True)
+
+    assert len(mapped) == 1
+    assert mapped[0].text == "Eagle Peak"
+    assert mapped[0].bounds == doc_text.extractions[1].bounds
+
+
+def test_build_indexed_text_token_limit(extractor):
+    candidates = [(f"Place {i}", i) for i in range(10)]
+
+    # each "(Place i, i)" line is 3 words, plus 1 for the separator
+    assert extractor._build_indexed_text(candidates).count("\n") == 9
+    points_str = extractor._build_indexed_text(candidates, token_limit=12)
+    assert points_str == "(Place 0, 0)\n(Place 1, 1)\n(Place 2, 2)"
+
+
+def test_process_doc_text_extraction_keeps_metadata_with_invalid_place_index(
+    monkeypatch,
+):
+    response = {
+        "title": "Geologic map of the Eagle Peak Quadrangle",
+        "crs": "EPSG:4267",
+        "places": [
+            {"name": "Eagle Peak", "index": 1},
+            {"name": "Made Up Hill", "index": 42},
+        ],
+        "population_centers": [],
+    }
+    extractor = create_extractor(monkeypatch, [json.dumps(response)])
+    doc_text = create_doc_text(
+        ["Geologic map of the Eagle Peak Quadrangle", "Mapped by D. K. Bailey"]
+    )
+    map_text = create_doc_text(["Bald Mountain", "Eagle Peak"])
+
+    metadata, point_locations = extractor._process_doc_text_extraction(
+        doc_text, map_text
+    )
+
+    assert metadata is not None
+    assert metadata.title == "Geologic map of the Eagle Peak Quadrangle"
+    assert point_locations is not None
+    assert [p.text for p in point_locations.places] == ["Eagle Peak"]
+
+
+def test_run_with_insufficient_text(extractor):
+    # fewer filtered words than MIN_TEXT_WORDS, so no LLM request is made
+    doc_text = create_doc_text(["Eagle Peak", "7000", "N"])
+    input = TaskInput(0)
+    input.raster_id = "test"
+    input.data = {TEXT_EXTRACTION_OUTPUT_KEY: doc_text.model_dump()}
+
+    result = extractor.run(input)
+
+    metadata = MetadataExtraction.model_validate(
+        result.output[METADATA_EXTRACTION_OUTPUT_KEY]
+    )
+    assert extractor._is_empty_extraction(metadata)
+
+
+@pytest.mark.parametrize(
+    "provider, expected_locations_model",
+    [
+        (LLM_PROVIDER.OPENAI, DEFAULT_LOCATIONS_GPT_MODEL),
+        (LLM_PROVIDER.AZURE, DEFAULT_GPT_MODEL),
+    ],
+)
+def test_default_locations_model(monkeypatch, provider, expected_locations_model):
+    requested_models = []
+
+    def get_chat_model(provider, model, model_api_version):
+        requested_models.append(model)
+        return FakeListChatModel(responses=["ok"])
+
+    monkeypatch.setattr(metadata_extraction, "get_chat_model", get_chat_model)
+    monkeypatch.setattr(metadata_extraction, "get_encoding", lambda _: WordEncoding())
+    MetadataExtractor("test-metadata", provider=provider)
+
+    # azure deployments aren't guaranteed to include the cheaper model
+    assert requested_models == [DEFAULT_GPT_MODEL, expected_locations_model]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        '{"name": "Eagle Peak", "index": 1}',
+        '```json\n{"name": "Eagle Peak", "index": 1}\n```',
+        'Here is the result: {"name": "Eagle Peak", "index": 1}\nLet me know if you need more.',
+    ],
+)
+def test_json_output_parser(extractor, content):
+    parser = extractor._json_output_parser(Location)
+
+    location = parser.invoke(AIMessage(content=content))
+
+    assert location == Location(name="Eagle Peak", index=1)
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import logging
+import numpy as np
 from PIL import Image
-from pydantic import BaseModel, validator, Field
-from typing import Optional, List, Union, Any, Dict
+from pydantic import BaseModel, PrivateAttr, validator, Field
+from typing import Optional, List, Union, Any
 
 logger = logging.getLogger(__name__)
 ## Data Objects
@@ -37,6 +38,20 @@ class PointLabel(BaseModel):
     dip: Optional[float] = None  # [deg] dip angle associated with symbol
 
 
+class PointLabelArrays(BaseModel):
+    """
+    Columnar (structure of arrays) view of a collection of PointLabel objects, for vectorized processing
+    """
+
+    bboxes: np.ndarray  # (N, 4) int32 array of x1, y1, x2, y2
+    class_ids: np.ndarray  # (N,) int32 array
+    scores: np.ndarray  # (N,) float32 array
+    class_names: np.ndarray  # (N,) array of class name strings
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
 class PointLabels(BaseModel):
     """
     Represents a collection of PointLabel objects for an image or region-of-interest
@@ -48,24 +63,47 @@ class PointLabels(BaseModel):
     labels: Optional[List[PointLabel]] = None
     legend_items: List[LegendPointItem] | None = []
 
-    _cached_image = None
+    _cached_image: Optional[Image.Image] = PrivateAttr(default=None)
+    _cached_size: Optional[tuple] = PrivateAttr(default=None)
 
     @property
     def size(self):
-        # Make use of the PIL Image.open lazy image loading to avoid loading the image prematurely.
-        return self.image.size
+        if self._cached_size is None:
+            if self._cached_image is not None:
+                self._cached_size = self._cached_image.size
+            else:
+                # only the image header is read here - the image isn't held open or decoded
+                with Image.open(self.path) as img:
+                    if img.size[0] == 0 or img.size[1] == 0:
+                        raise ValueError("Image cannot have 0 height or width")
+                    self._cached_size = img.size
+        return self._cached_size
 
     @property
     def image(self):
-        if self._cached_image:
-            img = self._cached_image
-        else:
-            img = Image.open(self.path)
-            if img.size[0] == 0 or img.size[1] == 0:
-                raise ValueError("Image cannot have 0 height or width")
-            self._cached_image = img
+        if self._cached_image is not None:
+            return self._cached_image
+        # validate the size on first load only - the cached image has already been checked
+        img = Image.open(self.path)
+        if img.size[0] == 0 or img.size[1] == 0:
+            raise ValueError("Image cannot have 0 height or width")
+        self._cached_image = img
         return img
 
+    def to_arrays(self) -> PointLabelArrays:
+        """
+        Converts the point labels to a columnar set of numpy arrays
+        """
+        labels = self.labels if self.labels else []
+        return PointLabelArrays(
+            bboxes=np.array(
+                [(lbl.x1, lbl.y1, lbl.x2, lbl.y2) for lbl in labels], dtype=np.int32
+            ).reshape(-1, 4),
+            class_ids=np.array([lbl.class_id for lbl in labels], dtype=np.int32),
+            scores=np.array([lbl.score for lbl in labels], dtype=np.float32),
+            class_names=np.array([lbl.class_name for lbl in labels], dtype=str),
+        )
+
 
 class ImageTile(BaseModel):
     """
@@ -110,20 +148,11 @@ class ImageTiles(BaseModel):
         - tile image raster is discarded
         """
 
-        tiles_cache = []
-        for t in self.tiles:
-            t_cache = ImageTile(
-                x_offset=t.x_offset,
-                y_offset=t.y_offset,
-                width=t.width,
-                height=t.height,
-                image=None,
-                image_path=t.image_path,
-                predictions=t.predictions,
-            )
-            tiles_cache.append(t_cache)
+        # tiles are already validated, so shallow copies with the image dropped are used
+        # rather than re-running validation on every tile
+        tiles_cache = [t.model_copy(update={"image": None}) for t in self.tiles]
 
-        return ImageTiles(
+        return ImageTiles.model_construct(
             raster_id=self.raster_id,
             roi_bounds=self.roi_bounds,
             roi_label=self.roi_label,
@@ -134,29 +163,22 @@ class ImageTiles(BaseModel):
         """
         Append cached point predictions to ImageTiles
         """
-        try:
-            if len(self.tiles) != len(cached_preds.tiles):
-                logger.warning(
-                    f"Number of tiles {len(self.tiles)} doesn't match cached tiles {len(cached_preds.tiles)}; disregarding cached results"
-                )
-                return False
-
-            # re-format cached predictions with key as (x_offset, y_offset)
-            cached_dict: Dict[Any, ImageTile] = {}
-            for p in cached_preds.tiles:
-                cached_dict[(p.x_offset, p.y_offset)] = p
-            for t in self.tiles:
-                key = (t.x_offset, t.y_offset)
-                if key not in cached_dict:
-                    # cached predictions not found for this tile!
-                    return False
-                t_cached: ImageTile = cached_dict[key]
-                t.predictions = t_cached.predictions
-
-            return True
-        except Exception as e:
-            logger.warning(f"Exception in join_with_cached_predictions: {str(e)}")
+        if len(self.tiles) != len(cached_preds.tiles):
+            logger.warning(
+                f"Number of tiles {len(self.tiles)} doesn't match cached tiles {len(cached_preds.tiles)}; disregarding cached results"
+            )
+            return False
+
+        # re-format cached predictions with key as (x_offset, y_offset)
+        cached_dict = {(p.x_offset, p.y_offset): p for p in cached_preds.tiles}
+        cached_tiles = [cached_dict.get((t.x_offset, t.y_offset)) for t in self.tiles]
+        if any(t_cached is None for t_cached in cached_tiles):
+            # cached predictions not found for a tile - leave all tiles untouched
             return False
+        for t, t_cached in zip(self.tiles, cached_tiles):
+            t.predictions = t_cached.predictions  # type: ignore
+
+        return True
 
 
 class LegendPointItem(BaseModel):
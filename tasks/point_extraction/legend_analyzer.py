@@ -1,8 +1,10 @@
-import json, logging, os
+import logging, os
 from collections import defaultdict
 import httpx
-from shapely import Polygon, distance
-from typing import Optional
+import math
+import numpy as np
+from shapely import Polygon
+from typing import Dict, List, Optional, Tuple
 from tasks.common.task import Task, TaskInput, TaskResult
 from tasks.point_extraction.entities import (
     LegendPointItems,
@@ -24,6 +26,10 @@ logger = logging.getLogger(__name__)
 CDR_API_TOKEN = os.environ.get("CDR_API_TOKEN", "")
 CDR_HOST = "https://api.cdr.land"
 CDR_LEGEND_SYSTEM_VERSION_DEFAULT = "polymer__0.0.1"
+CDR_REQUEST_TIMEOUT = httpx.Timeout(10.0, read=30.0)
+
+# swatch centroid x, y and width, height
+SwatchGeometry = Tuple[float, float, float, float]
 
 
 class LegendPreprocessor(Task):
@@ -39,8 +45,27 @@ class LegendPreprocessor(Task):
     ):
 
         self.fetch_legend_items = fetch_legend_items
+        # persistent client, so connections to the CDR are pooled and re-used across rasters
+        self._cdr_client: Optional[httpx.Client] = None
+        if fetch_legend_items and CDR_API_TOKEN:
+            self._cdr_client = httpx.Client(
+                follow_redirects=True,
+                headers={
+                    "accept": "application/json",
+                    "Authorization": f"Bearer {CDR_API_TOKEN}",
+                },
+                timeout=CDR_REQUEST_TIMEOUT,
+            )
         super().__init__(task_id, cache_path)
 
+    def close(self):
+        """
+        Close the CDR client connection pool, if open
+        """
+        if self._cdr_client is not None:
+            self._cdr_client.close()
+            self._cdr_client = None
+
     def run(self, task_input: TaskInput) -> TaskResult:
         """
         run point symbol legend analysis
@@ -93,9 +118,11 @@ class LegendPreprocessor(Task):
 
             handle_duplicate_labels(legend_pt_items)
 
+            # the model is passed through as-is; downstream tasks load it with
+            # LegendPointItems.model_validate, which returns model instances without re-validating
             return TaskResult(
                 task_id=self._task_id,
-                output={LEGEND_ITEMS_OUTPUT_KEY: legend_pt_items.model_dump()},
+                output={LEGEND_ITEMS_OUTPUT_KEY: legend_pt_items},
             )
 
         return self._create_result(task_input)
@@ -110,27 +137,22 @@ class LegendPreprocessor(Task):
         fetch legend annotations from the CDR for a given COG id
         """
 
-        if not CDR_API_TOKEN:
+        if not self._cdr_client:
             logger.warning("Unable to fetch legend items; CDR_API_TOKEN not set")
             return None
 
         try:
-            headers = {
-                "accept": "application/json",
-                "Authorization": f"Bearer {CDR_API_TOKEN}",
-            }
-            client = httpx.Client(follow_redirects=True)
             url = f"{CDR_HOST}/v1/features/{raster_id}/legend_items"
             if system_version:
                 url += f"?system_version={system_version}"
 
-            r = client.get(url, headers=headers)
+            r = self._cdr_client.get(url)
             if r.status_code != 200:
                 logger.warning(
                     f"Unable to fetch legend items for raster {raster_id}; cdr response code {r.status_code}"
                 )
                 return None
-            legend_anns = json.loads(r.content)
+            legend_anns = r.json()
             legend_pt_items = parse_legend_annotations(
                 legend_anns, raster_id, check_validated=check_validated
             )
@@ -186,55 +208,69 @@ class LegendPostprocessor(Task):
             )
         join_with_existing = len(legend_pt_items.items) > 0
 
-        # group legend pt predictions by class name
-        pred_groups = defaultdict(list)
-        for label in legend_pt_preds.labels:
-            pred_groups[label.class_name].append(label)
+        # group legend pt predictions by class name, and find the highest scoring one per class
+        # (first one wins on ties); classes are visited in order of first appearance
+        pred_arrs = legend_pt_preds.to_arrays()
+        class_names, class_first, class_inv, class_counts = np.unique(
+            pred_arrs.class_names,
+            return_index=True,
+            return_inverse=True,
+            return_counts=True,
+        )
+        pred_order = np.lexsort(
+            (np.arange(len(class_inv)), -pred_arrs.scores, class_inv.ravel())
+        )
+        class_best = pred_order[np.cumsum(class_counts) - class_counts]
+
+        # bin the legend item annotations by class once per run, rather than once per predicted class;
+        # swatch geometry is likewise computed at most once per legend item
+        legs_by_class = defaultdict(list)
+        leg_unmatched = []
+        for leg in legend_pt_items.items:
+            if leg.class_name:
+                legs_by_class[leg.class_name].append(leg)
+            else:
+                leg_unmatched.append(leg)
+        leg_geometry: Dict[int, SwatchGeometry] = {}
+        # geometry of the unlabelled swatches is stacked once; matched swatches are masked out
+        unmatched_arr = np.array(
+            [_cached_swatch_geometry(leg, leg_geometry) for leg in leg_unmatched],
+            dtype=np.float64,
+        ).reshape(-1, 4)
+        unmatched_open = np.ones(len(leg_unmatched), dtype=bool)
 
         # loop over groups
-        for class_name, preds in pred_groups.items():
-            if len(preds) > 1:
+        for c in np.argsort(class_first):
+            class_name = str(class_names[c])
+            if class_counts[c] > 1:
                 # more than 1 legend swatch extracted for this class name
                 # so choose the highest conf one, and discard the others as noisy
                 logger.info(
-                    f"{len(preds)} predictions found for point type {class_name}. Choosing the best one."
+                    f"{class_counts[c]} predictions found for point type {class_name}. Choosing the best one."
                 )
-                # sort by model confidence score
-                preds.sort(key=lambda s: s.score, reverse=True)
+            best = legend_pt_preds.labels[class_best[c]]
 
-            bbox = [preds[0].x1, preds[0].y1, preds[0].x2, preds[0].y2]
+            bbox = [best.x1, best.y1, best.x2, best.y2]
             xy_pts = [
-                [preds[0].x1, preds[0].y1],
-                [preds[0].x2, preds[0].y1],
-                [preds[0].x2, preds[0].y2],
-                [preds[0].x1, preds[0].y2],
+                [best.x1, best.y1],
+                [best.x2, best.y1],
+                [best.x2, best.y2],
+                [best.x1, best.y2],
             ]
-            confidence = preds[0].score
+            confidence = best.score
 
             if join_with_existing:
                 # check which legend ann swatch most overlaps with others,
                 # if multiple overlap, choose the closest one
                 # ... if this one is already in ontology choose that one
-                p_pred = Polygon(xy_pts)
-                leg_matches = list(
-                    filter(
-                        lambda leg: (leg.class_name == class_name),
-                        legend_pt_items.items,
-                    )
-                )
+                # prediction swatches are axis-aligned boxes, so no contour analysis is needed
+                pred_geometry = _bbox_geometry(bbox)
+                leg_matches = legs_by_class.get(class_name)
                 if leg_matches:
                     # legend swatch matches found
-                    p_leg = Polygon(leg_matches[0].legend_contour)
-                    smallest_dim = min(
-                        [
-                            p_leg.bounds[2] - p_leg.bounds[0],
-                            p_leg.bounds[3] - p_leg.bounds[1],
-                            p_pred.bounds[2] - p_pred.bounds[0],
-                            p_pred.bounds[3] - p_pred.bounds[1],
-                        ]
-                    )
-                    dist_norm = distance(p_leg.centroid, p_pred.centroid) / max(
-                        smallest_dim, 1.0
+                    dist_norm = _swatch_distance(
+                        _cached_swatch_geometry(leg_matches[0], leg_geometry),
+                        pred_geometry,
                     )
                     logger.info(
                         f"Joining legend swatch prediction with existing legend item annotation for class {class_name}; normalized distance = {dist_norm:.3f}"
@@ -242,51 +278,50 @@ class LegendPostprocessor(Task):
                 else:
                     # get legend item annotations without any class label,
                     # and match the one with highest overlap
-                    leg_unmatched = list(
-                        filter(
-                            lambda leg: (not leg.class_name),
-                            legend_pt_items.items,
-                        )
-                    )
+                    # normalized centroid distances to all unmatched swatches in a single
+                    # vectorized pass
                     i_min = -1
                     dist_min = 9999999.0
-                    for i, leg in enumerate(leg_unmatched):
-                        p_leg = Polygon(leg.legend_contour)
-                        smallest_dim = min(
-                            [
-                                p_leg.bounds[2] - p_leg.bounds[0],
-                                p_leg.bounds[3] - p_leg.bounds[1],
-                                p_pred.bounds[2] - p_pred.bounds[0],
-                                p_pred.bounds[3] - p_pred.bounds[1],
-                            ]
-                        )
-                        dist_norm = distance(p_leg.centroid, p_pred.centroid) / max(
-                            smallest_dim, 1.0
+                    if unmatched_open.any():
+                        pred_cx, pred_cy, pred_w, pred_h = pred_geometry
+                        smallest_dim = np.minimum(
+                            np.minimum(unmatched_arr[:, 2], unmatched_arr[:, 3]),
+                            min(pred_w, pred_h),
                         )
-                        if dist_norm < dist_min:
-                            dist_min = dist_norm
+                        dists = np.hypot(
+                            unmatched_arr[:, 0] - pred_cx, unmatched_arr[:, 1] - pred_cy
+                        ) / np.maximum(smallest_dim, 1.0)
+                        # degenerate swatches (nan geometry) never match
+                        dists[np.isnan(dists)] = np.inf
+                        dists[~unmatched_open] = np.inf
+                        i = int(np.argmin(dists))
+                        if dists[i] < dist_min:
+                            dist_min = float(dists[i])
                             i_min = i
                     if dist_min < 1.0:
                         # match found
                         logger.info(
                             f"Joining legend swatch prediction with existing legend item annotation for class {class_name}; normalized distance = {dist_min:.3f}"
                         )
-                        leg_unmatched[i_min].class_name = class_name
+                        leg = leg_unmatched[i_min]
+                        unmatched_open[i_min] = False
+                        leg.class_name = class_name
+                        legs_by_class[class_name].append(leg)
                     else:
                         # add a new legend point item based on ML legend analysis
                         # TODO could skip, if yolo confidence is low?
                         logger.info(
                             f"Adding new legend item for point class {class_name}"
                         )
-                        legend_pt_items.items.append(
-                            LegendPointItem(
-                                name=class_name,
-                                class_name=class_name,
-                                legend_bbox=bbox,
-                                legend_contour=xy_pts,
-                                confidence=confidence,
-                            )
+                        leg = LegendPointItem(
+                            name=class_name,
+                            class_name=class_name,
+                            legend_bbox=bbox,
+                            legend_contour=xy_pts,
+                            confidence=confidence,
                         )
+                        legend_pt_items.items.append(leg)
+                        legs_by_class[class_name].append(leg)
             else:
                 # add a new legend point item based on ML legend analysis
                 # TODO could skip, if yolo confidence is low?
@@ -307,5 +342,65 @@ class LegendPostprocessor(Task):
 
         return TaskResult(
             task_id=self._task_id,
-            output={LEGEND_ITEMS_OUTPUT_KEY: legend_pt_items.model_dump()},
+            output={LEGEND_ITEMS_OUTPUT_KEY: legend_pt_items},
         )
+
+
+def _swatch_geometry(contour: List) -> SwatchGeometry:
+    """
+    Calculates the centroid and width, height of a legend swatch contour.  Axis-aligned rectangles,
+    the common case, are handled directly - other contours fall back to shapely for the centroid
+    """
+    pts = np.asarray(contour, dtype=np.float64)
+    if pts.ndim != 2 or len(pts) == 0:
+        return (math.nan, math.nan, math.nan, math.nan)
+    min_x, min_y = pts.min(axis=0)
+    max_x, max_y = pts.max(axis=0)
+    if (
+        len(pts) == 4
+        and set(pts[:, 0]) == {min_x, max_x}
+        and set(pts[:, 1]) == {min_y, max_y}
+    ):
+        cx = (min_x + max_x) / 2
+        cy = (min_y + max_y) / 2
+    else:
+        centroid = Polygon(contour).centroid
+        cx, cy = centroid.x, centroid.y
+    return (float(cx), float(cy), float(max_x - min_x), float(max_y - min_y))
+
+
+def _bbox_geometry(bbox: List) -> SwatchGeometry:
+    """
+    Calculates the centroid and width, height of an [x1, y1, x2, y2] bounding box
+    """
+    x1, y1, x2, y2 = bbox
+    return (
+        (x1 + x2) / 2.0,
+        (y1 + y2) / 2.0,
+        float(abs(x2 - x1)),
+        float(abs(y2 - y1)),
+    )
+
+
+def _cached_swatch_geometry(
+    leg: LegendPointItem, cache: Dict[int, SwatchGeometry]
+) -> SwatchGeometry:
+    """
+    Returns the swatch geometry for a legend item, computing it on first use only
+    """
+    key = id(leg)
+    if key not in cache:
+        cache[key] = _swatch_geometry(leg.legend_contour)
+    return cache[key]
+
+
+def _swatch_distance(
+    leg_geometry: SwatchGeometry, pred_geometry: SwatchGeometry
+) -> float:
+    """
+    Distance between the centroids of two swatches, normalized by the smallest swatch dimension
+    """
+    leg_cx, leg_cy, leg_w, leg_h = leg_geometry
+    pred_cx, pred_cy, pred_w, pred_h = pred_geometry
+    smallest_dim = min(leg_w, leg_h, pred_w, pred_h)
+    return math.hypot(leg_cx - pred_cx, leg_cy - pred_cy) / max(smallest_dim, 1.0)
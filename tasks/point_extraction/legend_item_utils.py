@@ -1,7 +1,11 @@
 import logging
 from enum import Enum
+from functools import lru_cache
 from typing import List, Tuple
 from collections import defaultdict
+import numpy as np
+import shapely
+from pydantic import TypeAdapter
 from shapely import Polygon, distance
 
 from tasks.point_extraction.entities import LegendPointItem, LegendPointItems
@@ -12,6 +16,24 @@ from tasks.segmentation.entities import MapSegmentation, SEGMENT_POINT_LEGEND_CL
 
 logger = logging.getLogger(__name__)
 
+# (suffix, point class) pairs ordered longest suffix first, so the first match found
+# is the longest one
+LABEL_SUFFIXES = sorted(
+    (
+        (suffix, symbol_class)
+        for symbol_class, suffixs in LABEL_MAPPING.items()
+        for suffix in suffixs
+    ),
+    key=lambda a: len(a[0]),
+    reverse=True,
+)
+
+# CDR ontology term to point class lookup
+CDR_TO_YOLO_LABEL = {v: k for k, v in YOLO_TO_CDR_LABEL.items()}
+
+# bulk validator for lists of CDR legend item responses
+LEGEND_ITEM_RESPONSES_ADAPTER = TypeAdapter(List[LegendItemResponse])
+
 
 # Legend item annotations "system" or provenance labels
 class LEGEND_ANNOTATION_PROVENANCE(str, Enum):
@@ -35,21 +57,28 @@ def parse_legend_annotations(
     """
 
     # parse legend annotations and group by system label
+    try:
+        # validate the whole list in one pass
+        leg_resps = LEGEND_ITEM_RESPONSES_ADAPTER.validate_python(legend_anns)
+    except Exception:
+        # one or more bad annotations; validate per item so the rest can still be used
+        leg_resps = []
+        for leg_ann in legend_anns:
+            try:
+                leg_resps.append(LegendItemResponse(**leg_ann))
+            except Exception as e:
+                logger.error(
+                    f"EXCEPTION parsing legend annotations json for raster {raster_id}: {repr(e)}"
+                )
+
     legend_item_resps = defaultdict(list)
     count_leg_items = 0
-    for leg_ann in legend_anns:
-        try:
-            leg_resp = LegendItemResponse(**leg_ann)
-            validated_ok = leg_resp.validated if check_validated else True
-            if leg_resp.system in system_filter and validated_ok:
-                # only keep legend item responses from desired systems
-                legend_item_resps[leg_resp.system].append(leg_resp)
-                count_leg_items += 1
-        except Exception as e:
-            # legend_pt_items = LegendPointItems(items=[], provenance="")
-            logger.error(
-                f"EXCEPTION parsing legend annotations json for raster {raster_id}: {repr(e)}"
-            )
+    for leg_resp in leg_resps:
+        validated_ok = leg_resp.validated if check_validated else True
+        if leg_resp.system in system_filter and validated_ok:
+            # only keep legend item responses from desired systems
+            legend_item_resps[leg_resp.system].append(leg_resp)
+            count_leg_items += 1
     logger.info(f"Successfully loaded {count_leg_items} LegendItemResponse objects")
 
     # try to parse non-labelme annotations first
@@ -96,15 +125,9 @@ def parse_legend_point_hints(legend_hints: dict, raster_id: str) -> LegendPointI
         # contour coords for the legend item's thumbnail swatch
         xy_pts = shape.get("points", [])
         if xy_pts:
-            x_min = xy_pts[0][0]
-            x_max = xy_pts[0][0]
-            y_min = xy_pts[0][1]
-            y_max = xy_pts[0][1]
-            for x, y in xy_pts:
-                x_min = int(min(x, x_min))
-                x_max = int(max(x, x_max))
-                y_min = int(min(y, y_min))
-                y_max = int(max(y, y_max))
+            pts = np.asarray(xy_pts, dtype=np.float64)
+            x_min, y_min = (int(v) for v in pts.min(axis=0))
+            x_max, y_max = (int(v) for v in pts.max(axis=0))
         else:
             x_min = 0
             x_max = 0
@@ -137,35 +160,29 @@ def find_legend_keyword_match(legend_item_name: str, raster_id: str) -> str:
     """
     Use keyword matching to map legend item label to point extractor ontology class names
     """
-    leg_label_norm = raster_id + "_" + legend_item_name.strip().lower()
-    matches = []
-    for symbol_class, suffixs in LABEL_MAPPING.items():
-        for s in suffixs:
-            if s in leg_label_norm:
-                # match found
-                matches.append((s, symbol_class))
-    if matches:
-        # sort to get longest suffix match
-        matches.sort(key=lambda a: len(a[0]), reverse=True)
-        symbol_class = matches[0][1]
+    symbol_class = _match_legend_keyword(legend_item_name, raster_id)
+    if symbol_class:
         logger.info(
             f"Legend label: {legend_item_name} matches point class: {symbol_class}"
         )
-        return symbol_class
+    else:
+        logger.info(f"No point class match found for legend label: {legend_item_name}")
+    return symbol_class
 
-    # if no matches, then double-check exact matches with CDR ontology terms
-    cdr_to_yolo = {v: k for k, v in YOLO_TO_CDR_LABEL.items()}
-    leg_label_norm = legend_item_name.strip().lower()
-    if leg_label_norm in cdr_to_yolo:
-        # match found
-        symbol_class = cdr_to_yolo[leg_label_norm]
-        logger.info(
-            f"Legend label: {legend_item_name} matches point class: {symbol_class}"
-        )
-        return symbol_class
 
-    logger.info(f"No point class match found for legend label: {legend_item_name}")
-    return ""
+@lru_cache(maxsize=4096)
+def _match_legend_keyword(legend_item_name: str, raster_id: str) -> str:
+    """
+    Memoized keyword match of a legend item label (no side effects, so safe to cache)
+    """
+    leg_label_norm = raster_id + "_" + legend_item_name.strip().lower()
+    # suffixes are checked longest first, so the first match is the longest suffix match
+    for s, symbol_class in LABEL_SUFFIXES:
+        if s in leg_label_norm:
+            return symbol_class
+
+    # if no matches, then double-check exact matches with CDR ontology terms
+    return CDR_TO_YOLO_LABEL.get(legend_item_name.strip().lower(), "")
 
 
 def get_swatch_contour(bbox: List, xy_pts: List[List]) -> Tuple:
@@ -173,8 +190,8 @@ def get_swatch_contour(bbox: List, xy_pts: List[List]) -> Tuple:
         return (bbox, xy_pts)
     if xy_pts:
         # calc bbox from contour
-        p = Polygon(xy_pts)
-        bbox = list(p.bounds)
+        pts = np.asarray(xy_pts, dtype=np.float64)
+        bbox = pts.min(axis=0).tolist() + pts.max(axis=0).tolist()
     if bbox:
         xy_pts = [
             [bbox[0], bbox[1]],
@@ -261,24 +278,30 @@ def filter_labelme_annotations(
         leg_point_items.items = []
         return
 
+    items = leg_point_items.items
+    if not items:
+        return
+
+    # swatch centroids and shape heuristics are computed once per legend item, rather than once per segment
+    centroids = shapely.centroid([Polygon(leg.legend_contour) for leg in items])
+    cent_x = shapely.get_x(centroids)
+    cent_y = shapely.get_y(centroids)
+    bboxes = np.array([leg.legend_bbox[:4] for leg in items], dtype=np.float64)
+    w = bboxes[:, 2] - bboxes[:, 0]
+    h = bboxes[:, 3] - bboxes[:, 1]
+    # legend item label is in points ontology, or legend item swatch bbox is close to square
+    # (to determine if swatch is line vs point symbol)
+    is_point_like = np.array([bool(leg.class_name) for leg in items]) | (
+        (w < width_thres) & (w < shape_thres * h)
+    )
+
     filtered_leg_items = []
     for seg in segs_point_legend:
-        p_seg = Polygon(seg.poly_bounds)
-        for leg in leg_point_items.items:
-            p_leg = Polygon(leg.legend_contour)
-            if not p_seg.intersects(p_leg.centroid):
-                # this legend swatch is not within the points legend area; disregard
-                continue
-            # legend swatch intersects the points legend area
-            # check other properties to determine if swatch is line vs point symbol
-            w = leg.legend_bbox[2] - leg.legend_bbox[0]
-            h = leg.legend_bbox[3] - leg.legend_bbox[1]
-            if leg.class_name:
-                # legend item label is in points ontology
-                filtered_leg_items.append(leg)
-            elif w < width_thres and w < shape_thres * h:
-                # legend item swatch bbox is close to square
-                filtered_leg_items.append(leg)
+        # legend swatches that intersect the points legend area (others are disregarded)
+        in_seg = shapely.intersects_xy(Polygon(seg.poly_bounds), cent_x, cent_y)
+        filtered_leg_items.extend(
+            items[i] for i in np.flatnonzero(in_seg & is_point_like)
+        )
     leg_point_items.items = filtered_leg_items
 
 
@@ -1,3 +1,4 @@
+from tasks.common.image_io import image_content_hash
 from tasks.common.io import Mode, get_file_source
 from tasks.point_extraction.entities import (
     ImageTile,
@@ -56,6 +57,8 @@ class YOLOPointDetector(Task):
         self.bsz = batch_size
         self.device = device
         self._model_id = self._get_model_id(self.model)
+        # class id -> class name lookup (looked up once, since YOLO.names is a computed property)
+        self._class_names = self.model.names
 
         super().__init__(task_id, cache_path)
 
@@ -116,38 +119,58 @@ class YOLOPointDetector(Task):
 
         return local_model_data_path
 
-    def process_output(self, predictions: Results) -> List[PointLabel]:
+    def process_output(self, boxes: List[List[float]]) -> List[PointLabel]:
         """
         Convert point detection inference results from YOLO model format
+        (rows of x1, y1, x2, y2, score, class_id already copied to the host)
         to a list of PointLabel objects
         """
         pt_labels = []
-        for pred in predictions:
-            assert pred.boxes is not None
-            assert isinstance(pred.boxes.data, torch.Tensor)
-            assert isinstance(self.model.names, Dict)
-
-            if len(pred.boxes.data) == 0:
-                continue
-            for box in pred.boxes.data.detach().cpu().tolist():
-                x1, y1, x2, y2, score, class_id = box
-                class_name = self.model.names[int(class_id)]
-
-                pt_labels.append(
-                    PointLabel(
-                        classifier_name=MODEL_NAME,
-                        classifier_version=self._model_id,
-                        class_id=int(class_id),
-                        class_name=class_name,
-                        x1=int(x1),
-                        y1=int(y1),
-                        x2=int(x2),
-                        y2=int(y2),
-                        score=score,
-                    )
+        class_names = self._class_names
+        assert isinstance(class_names, Dict)
+        for box in boxes:
+            x1, y1, x2, y2, score, class_id = box
+            class_name = class_names[int(class_id)]
+
+            # fields are already typed from the model output, so skip validation
+            pt_labels.append(
+                PointLabel.model_construct(
+                    classifier_name=MODEL_NAME,
+                    classifier_version=self._model_id,
+                    class_id=int(class_id),
+                    class_name=class_name,
+                    x1=int(x1),
+                    y1=int(y1),
+                    x2=int(x2),
+                    y2=int(y2),
+                    score=score,
                 )
+            )
         return pt_labels
 
+    def _batch_boxes_to_host(
+        self, batch_preds: List[Results]
+    ) -> List[List[List[float]]]:
+        """
+        Copy the detected boxes for a whole batch of YOLO results to the host in a single transfer,
+        and split them back out per tile
+        """
+        box_data = []
+        for preds in batch_preds:
+            assert preds.boxes is not None
+            assert isinstance(preds.boxes.data, torch.Tensor)
+            box_data.append(preds.boxes.data)
+        counts = [len(data) for data in box_data]
+        if sum(counts) == 0:
+            return [[] for _ in counts]
+        boxes = torch.cat(box_data).detach().cpu().tolist()
+        boxes_per_tile = []
+        start = 0
+        for count in counts:
+            boxes_per_tile.append(boxes[start : start + count])
+            start += count
+        return boxes_per_tile
+
     def run(self, task_input: TaskInput) -> TaskResult:
         """
         run YOLO model inference for point symbol detection
@@ -210,11 +233,24 @@ class YOLOPointDetector(Task):
             )
             return
 
-        tiles_out: List[ImageTile] = []
+        # identical tiles (e.g., blank margins or repeated background) give identical predictions,
+        # so inference is only run once per distinct tile content
+        unique_tiles: Dict[bytes, ImageTile] = {}
+        tile_keys = []
+        for tile in image_tiles.tiles:
+            key = image_content_hash(tile.image)
+            tile_keys.append(key)
+            unique_tiles.setdefault(key, tile)
+        inference_tiles = list(unique_tiles.values())
+        if len(inference_tiles) < len(image_tiles.tiles):
+            logger.info(
+                f"Skipping inference on {len(image_tiles.tiles) - len(inference_tiles)} duplicate tiles"
+            )
+
         # run batch model inference...
-        for i in tqdm(range(0, len(image_tiles.tiles), self.bsz)):
+        for i in tqdm(range(0, len(inference_tiles), self.bsz)):
             logger.info(f"Processing batch {i} to {i + self.bsz}")
-            batch = image_tiles.tiles[i : i + self.bsz]
+            batch = inference_tiles[i : i + self.bsz]
             images = [tile.image for tile in batch]
             # note: ideally tile sizes used should be the same size as used during model training
             # tiles can be resized during inference pre-processing, if needed using 'imgsz' param
@@ -225,11 +261,14 @@ class YOLOPointDetector(Task):
                 conf=CONF_THRES,
                 iou=IOU_THRES,
             )
-            for tile, preds in zip(batch, batch_preds):
-                tile.predictions = self.process_output(preds)
-                tiles_out.append(tile)
-        # save tile results with point extraction predictions
-        image_tiles.tiles = tiles_out
+            for tile, boxes in zip(batch, self._batch_boxes_to_host(batch_preds)):
+                tile.predictions = self.process_output(boxes)
+
+        # copy predictions to the duplicate tiles (predictions are in tile-local pixel coords)
+        for tile, key in zip(image_tiles.tiles, tile_keys):
+            source_tile = unique_tiles[key]
+            if tile is not source_tile:
+                tile.predictions = list(source_tile.predictions or [])
 
         # write to cache
         self.write_result_to_cache(image_tiles.format_for_caching(), doc_key)
@@ -4,19 +4,19 @@ import logging
 import numpy as np
 from PIL import Image
 
-from collections import defaultdict
 from tasks.point_extraction.entities import PointLabels, LegendPointItems
 from tasks.point_extraction.label_map import YOLO_TO_CDR_LABEL
 from tasks.text_extraction.entities import TextExtraction
 from shapely.geometry import Polygon
 from shapely.strtree import STRtree
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Union
 
 
 COLOUR_RANGE_L = 40  # for separating foreground vs background pixels (lower == more aggressive foregnd masking)
 COLOUR_RANGE_AB = 35
 WHITE_SHIFT = 100  # emphasize the foreground features by whitening
 WHITE_LAB = (255, 128, 128)  # white in LAB colour-space
+WHITE_RGB = (255, 255, 255)
 
 # matches chars that are not numbers or letters
 RE_NON_ALPHANUMERIC = re.compile(r"[^0-9A-Za-z]")
@@ -67,23 +67,29 @@ def crop_template(
     """
 
     fy, fx = np.where(fore_mask != 0)
-    template = cv2.copyMakeBorder(
-        template,
-        crop_buffer,
-        crop_buffer,
-        crop_buffer,
-        crop_buffer,
-        cv2.BORDER_CONSTANT,
-        value=backgnd_colour,
-    )
-    fy = fy + crop_buffer
-    fx = fx + crop_buffer
     h, w = template.shape[0], template.shape[1]
-    tx_min = max(fx.min() - crop_buffer, 0)
-    tx_max = min(fx.max() + crop_buffer + 1, w - 1)
-    ty_min = max(fy.min() - crop_buffer, 0)
-    ty_max = min(fy.max() + crop_buffer + 1, h - 1)
-    template = template[ty_min:ty_max, tx_min:tx_max]
+    # crop bounds (in original template coords) may extend past the template edges by up to crop_buffer pixels
+    tx_min = fx.min() - crop_buffer
+    tx_max = min(fx.max() + crop_buffer + 1, w + crop_buffer - 1)
+    ty_min = fy.min() - crop_buffer
+    ty_max = min(fy.max() + crop_buffer + 1, h + crop_buffer - 1)
+    cx_min, cx_max = max(tx_min, 0), min(tx_max, w)
+    cy_min, cy_max = max(ty_min, 0), min(ty_max, h)
+    template = template[cy_min:cy_max, cx_min:cx_max]
+
+    # only pad with background pixels on the sides where the crop extends past the template edges
+    pad_top, pad_bottom = cy_min - ty_min, ty_max - cy_max
+    pad_left, pad_right = cx_min - tx_min, tx_max - cx_max
+    if pad_top > 0 or pad_bottom > 0 or pad_left > 0 or pad_right > 0:
+        template = cv2.copyMakeBorder(
+            template,
+            int(pad_top),
+            int(pad_bottom),
+            int(pad_left),
+            int(pad_right),
+            cv2.BORDER_CONSTANT,
+            value=backgnd_colour,
+        )
 
     return template
 
@@ -97,14 +103,13 @@ def template_conncomp_denoise(
 
     def get_max_area_conncomp(im_binary: np.ndarray):
         num_cc, im_labels, stats, centroids = cv2.connectedComponentsWithStats(
-            fore_mask, connectivity=8
+            im_binary, connectivity=8
         )
         # Find the largest non background component.
-        # Note: range() starts from 1 since 0 is the background label.
-        cc_label_max, cc_area_max = max(
-            [(i, stats[i, cv2.CC_STAT_AREA]) for i in range(1, num_cc)],
-            key=lambda x: x[1],
-        )
+        # Note: areas start from label 1 since 0 is the background label.
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        cc_label_max = int(areas.argmax()) + 1
+        cc_area_max = int(areas[cc_label_max - 1])
 
         return (im_labels, cc_label_max, cc_area_max)
 
@@ -137,13 +142,9 @@ def template_conncomp_denoise(
 
     # generate de-noised versions of template and mask images
     idx = im_labels == cc_label_max
-    im_templ_denoise = np.ones(im_templ.shape).astype(np.uint8)
-    im_templ_denoise[:, :, 0] = med_val[0]
-    im_templ_denoise[:, :, 1] = med_val[1]
-    im_templ_denoise[:, :, 2] = med_val[2]
+    im_templ_denoise = np.broadcast_to(med_val, im_templ.shape).copy()
     im_templ_denoise[idx] = im_templ[idx]
-    fore_mask_denoise = np.zeros(im_labels.shape).astype(np.uint8)
-    fore_mask_denoise[idx] = 255
+    fore_mask_denoise = idx.astype(np.uint8) * 255
 
     return im_templ_denoise, fore_mask_denoise
 
@@ -170,22 +171,23 @@ def template_pre_processing(
             cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU,
         )
 
-    # ---- Convert to LAB colour-space
-    im_templ = cv2.cvtColor(im_templ, cv2.COLOR_RGB2LAB)
+    # ---- Convert to LAB colour-space (only needed for the colour stats)
+    im_templ_lab = cv2.cvtColor(im_templ, cv2.COLOR_RGB2LAB)
 
     # get the 'foreground' pixel values from the template, and
     # get template colour stats
     idx = im_templ_mask != 0
-    templ_fore = im_templ[idx]
-    colour_med_val = np.median(templ_fore, axis=0)  # type: ignore
+    templ_fore = im_templ_lab[idx]
+    # templ_fore is a fresh copy (from boolean indexing), so it can be partitioned in-place
+    colour_med_val = np.median(templ_fore, axis=0, overwrite_input=True)  # type: ignore
     colour_med_val = [int(x) for x in colour_med_val.tolist()]
 
     # final cropping of the template and size normalization
+    # (done on the original RGB template, so no conversion back from LAB is needed;
+    # any alpha channel is dropped, as with the LAB conversion)
     im_templ = crop_template(
-        im_templ, im_templ_mask, crop_buffer=5, backgnd_colour=WHITE_LAB
+        im_templ[:, :, :3], im_templ_mask, crop_buffer=5, backgnd_colour=WHITE_RGB
     )
-    # convert results back to RGB colour space
-    im_templ = cv2.cvtColor(im_templ, cv2.COLOR_LAB2RGB)
 
     return (im_templ, colour_med_val)
 
@@ -205,19 +207,22 @@ def image_pre_processing(
         foregnd_colour_lab, [COLOUR_RANGE_L, COLOUR_RANGE_AB, COLOUR_RANGE_AB]
     )
 
-    # ---- Convert to LAB colour-space
-    im = cv2.cvtColor(im, cv2.COLOR_RGB2LAB)
+    # ---- Convert to LAB colour-space (only needed for the foreground mask)
+    im_lab = cv2.cvtColor(im, cv2.COLOR_RGB2LAB)
 
     # ---- De-emphasize (whiten) non-foreground pixels in the main image
     # create a mask to separate foreground and background pixels
-    im_mask = cv2.inRange(im, colour_lower, colour_upper)
+    im_mask = cv2.inRange(im_lab, colour_lower, colour_upper)
     kernel_morph = np.ones((3, 3), np.uint8)
     im_mask = cv2.dilate(im_mask, kernel_morph, iterations=1)
-    idx = im_mask == 0  # pxl x,y for background
-    im = cv2.cvtColor(im, cv2.COLOR_LAB2RGB)
-    im = im.astype(np.float32)
-    im[idx] = np.clip(im[idx] + WHITE_SHIFT, 0, 255)
-    im = im.astype(np.uint8)
+    im_backgnd_mask = cv2.bitwise_not(im_mask)  # pxl x,y for background
+    # the mask is applied to a copy of the original RGB pixels,
+    # rather than converting the LAB image back to RGB
+    im = im.copy()
+    # whiten background pixels in-place with a saturating uint8 add (clips at 255)
+    cv2.add(
+        im, (WHITE_SHIFT, WHITE_SHIFT, WHITE_SHIFT, 0), dst=im, mask=im_backgnd_mask
+    )
 
     return im
 
@@ -231,17 +236,12 @@ def template_matching(im: np.ndarray, im_templ: np.ndarray, search_range=-1) ->
     returns max x-correlation value and x,y pixel location
     """
 
-    # ---- find the template match values for a given template
-    im_xcorr = cv2.matchTemplate(im, im_templ, cv2.TM_CCOEFF_NORMED)
-
-    # note: im_xcorr has dimensions (W-w+1, H-h+1)
+    # note: the full xcorr result has dimensions (H-h+1, W-w+1)
     # so each im_xcorr pxel maps to the orig image pixel - half the template size (in each dimension)
     # xcorr x = base image x - (template width / 2)
     # xcorr y = base image y - (template height / 2)
     # https://docs.opencv.org/3.4/d4/dc6/tutorial_py_template_matching.html
 
-    im_xcorr = np.nan_to_num(im_xcorr, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
-
     y_offset = int(im_templ.shape[0] / 2)
     x_offset = int(im_templ.shape[1] / 2)
 
@@ -249,19 +249,35 @@ def template_matching(im: np.ndarray, im_templ: np.ndarray, search_range=-1) ->
     y_c = int(im.shape[0] / 2)
     x_c = int(im.shape[1] / 2)
 
+    ymin, xmin = 0, 0
+    ymax = im.shape[0] - im_templ.shape[0] + 1
+    xmax = im.shape[1] - im_templ.shape[1] + 1
     if search_range >= 0:
         # restrict xcorr to search_range pixels around the center of the base image
         search_half = int(search_range / 2)
         ymin = max(y_c - y_offset - search_half, 0)
         xmin = max(x_c - x_offset - search_half, 0)
-        ymax = min(y_c - y_offset + search_half, im_xcorr.shape[0])
-        xmax = min(x_c - x_offset + search_half, im_xcorr.shape[1])
-
-        im_xcorr = im_xcorr[ymin:ymax, xmin:xmax]
+        ymax = min(y_c - y_offset + search_half, ymax)
+        xmax = min(x_c - x_offset + search_half, xmax)
 
         x_offset -= xmin
         y_offset -= ymin
 
+    window_ok = ymax > ymin and xmax > xmin
+    if window_ok:
+        # each xcorr value only depends on the base image pixels under the template,
+        # so only the part of the base image covering the search window needs to be matched
+        im = im[
+            ymin : ymax + im_templ.shape[0] - 1, xmin : xmax + im_templ.shape[1] - 1
+        ]
+
+    # ---- find the template match values for a given template
+    im_xcorr = cv2.matchTemplate(im, im_templ, cv2.TM_CCOEFF_NORMED)
+    if not window_ok:
+        im_xcorr = im_xcorr[ymin:ymax, xmin:xmax]
+    # normalized xcorr values are bounded (no +/-inf), so only NaNs need to be zeroed
+    np.copyto(im_xcorr, 0.0, where=np.isnan(im_xcorr))
+
     # https://stackoverflow.com/questions/55284090/how-to-find-maximum-value-in-whole-2d-array-with-indices
     max_xy = np.unravel_index(im_xcorr.argmax(), im_xcorr.shape)
     max_val = im_xcorr[max_xy]
@@ -290,6 +306,25 @@ def angle_in_range(theta: float, a: float, b: float) -> bool:
         return theta1 >= a1 or theta1 <= b1
 
 
+def angles_in_range(
+    theta: np.ndarray, a: Union[np.ndarray, float], b: Union[np.ndarray, float]
+) -> np.ndarray:
+    """
+    vectorized version of angle_in_range, for arrays of angles
+    - a and b can be scalars or arrays broadcastable with theta
+    - returns a boolean array
+    """
+    theta1 = np.mod(theta, 360)  # ensure all angles are 0 to 360 deg range
+    a1 = np.mod(a, 360)
+    b1 = np.mod(b, 360)
+    # if a1 > b1, then the angle range wraps around 0 deg
+    return np.where(
+        a1 <= b1,
+        (theta1 >= a1) & (theta1 <= b1),
+        (theta1 >= a1) | (theta1 <= b1),
+    )
+
+
 def mask_ocr_blocks(
     im: np.ndarray,
     text_extractions: List[TextExtraction],
@@ -310,8 +345,15 @@ def mask_ocr_blocks(
             if min_len > 0 and len(prose) <= min_len:
                 continue
 
-            p = Polygon([(pt.x, pt.y) for pt in blk.bounds])
-            (xmin, ymin, xmax, ymax) = [int(b) for b in p.bounds]
+            # only the block's bounding box is needed, so skip building a shapely polygon
+            xs = [pt.x for pt in blk.bounds]
+            ys = [pt.y for pt in blk.bounds]
+            (xmin, ymin, xmax, ymax) = (
+                int(min(xs)),
+                int(min(ys)),
+                int(max(xs)),
+                int(max(ys)),
+            )
             if xmin == xmax or ymin == ymax:
                 continue
             ocr_blk_area = (ymax - ymin) * (xmax - xmin)
@@ -326,9 +368,8 @@ def mask_ocr_blocks(
             ]  # TODO - or just get median val along the top?
             if ocr_pxl_slice.size > 0:
                 med_val = np.median(ocr_pxl_slice, axis=[0, 1])
-                ocr_pxl_slice[:, :, 0] = med_val[0]
-                ocr_pxl_slice[:, :, 1] = med_val[1]
-                ocr_pxl_slice[:, :, 2] = med_val[2]
+                # fill all channels in one broadcast write
+                ocr_pxl_slice[:] = med_val
 
     return im
 
@@ -365,34 +406,43 @@ def convert_preds_to_bitmasks(
     # note, for contest bitmask output names use legend annotations/hints labels in place of
     # CDR point ontology, where applicable
     pt_class_to_legend_name = {}
-    point_preds_by_class = defaultdict(list)
+    empty_centers = np.empty((0, 2), dtype=np.int32)
+    point_centers_by_class: Dict[str, np.ndarray] = {}
     # create class name to legend item mapping
     for leg_item in legend_pt_items.items:
         pt_name = get_cdr_point_name(leg_item.class_name, leg_item.name)
         pt_class_to_legend_name[pt_name] = leg_item.name
         # also create empty point_preds entry, so we will create an empty bitmask
         # even if no extractions were found for a given point type
-        point_preds_by_class[pt_name] = []
-
-    for map_pt_label in map_pt_labels.labels:
-        pt_name = get_cdr_point_name(map_pt_label.class_name, "")
-        # bbox center
-        xc = int((map_pt_label.x1 + map_pt_label.x2) / 2)
-        yc = int((map_pt_label.y1 + map_pt_label.y2) / 2)
-        point_preds_by_class[pt_name].append((xc, yc))
+        point_centers_by_class[pt_name] = empty_centers
+
+    # compute all bbox centers at once from the columnar labels, then group them by class using
+    # a stable sort so each class gets a contiguous slice of the center array
+    label_arrays = map_pt_labels.to_arrays()
+    unique_names, name_idx = np.unique(label_arrays.class_names, return_inverse=True)
+    cdr_names = np.array([get_cdr_point_name(name, "") for name in unique_names])
+    pt_names = cdr_names[name_idx]
+    bboxes = label_arrays.bboxes
+    centers = ((bboxes[:, :2] + bboxes[:, 2:]) / 2).astype(np.int32)
+    order = np.argsort(pt_names, kind="stable")
+    class_names, starts = np.unique(pt_names[order], return_index=True)
+    for class_name, class_centers in zip(
+        class_names, np.split(centers[order], starts[1:])
+    ):
+        point_centers_by_class[str(class_name)] = class_centers
 
     logger.info(
-        f"Creating {len(point_preds_by_class)} bitmasks for raster id {map_pt_labels.raster_id}"
+        f"Creating {len(point_centers_by_class)} bitmasks for raster id {map_pt_labels.raster_id}"
     )
 
     bitmasks = {}
-    for class_name, pts_xy in point_preds_by_class.items():
+    for class_name, pt_centers in point_centers_by_class.items():
         im_binary = np.zeros((w_h[1], w_h[0]), dtype=np.uint8)
-        for x, y in pts_xy:
-            im_binary[y, x] = binary_pixel_val
+        # set all points for the class in a single vectorized write
+        im_binary[pt_centers[:, 1], pt_centers[:, 0]] = binary_pixel_val
         # generate final bitmask feature label and store result
         pt_label = pt_class_to_legend_name.get(class_name, class_name)
         pt_label = pt_label.strip().replace(" ", "_")
-        bitmasks[pt_label] = Image.fromarray(im_binary.astype(np.uint8))
+        bitmasks[pt_label] = Image.fromarray(im_binary)
 
     return bitmasks
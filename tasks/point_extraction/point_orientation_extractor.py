@@ -1,4 +1,8 @@
-from tasks.point_extraction.entities import PointLabels, MAP_PT_LABELS_OUTPUT_KEY
+from tasks.point_extraction.entities import (
+    PointLabel,
+    PointLabels,
+    MAP_PT_LABELS_OUTPUT_KEY,
+)
 from tasks.common.task import Task, TaskInput, TaskResult
 from tasks.point_extraction.label_map import POINT_CLASS
 from tasks.point_extraction.task_config import PointOrientationConfig
@@ -9,14 +13,16 @@ from tasks.text_extraction.entities import (
     TEXT_EXTRACTION_OUTPUT_KEY,
 )
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import cv2
 import logging
 import math
+import os
 import numpy as np
 import re
 from PIL import Image
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from shapely.geometry import box
 from shapely.strtree import STRtree
 from shapely import distance
@@ -33,6 +39,9 @@ FOREGND_COLOR_LAB = [0, 128, 128]  # template default foregnd color (in LAB spac
 
 class PointOrientationExtractor(Task):
 
+    # max threads used for template matching of point symbols
+    MAX_MATCH_WORKERS = os.cpu_count()
+
     # ---- supported point classes and corresponding template image paths
     POINT_TEMPLATES = {
         str(
@@ -106,6 +115,8 @@ class PointOrientationExtractor(Task):
     def __init__(self, task_id: str, points_model_id: str, cache_path: str):
         self.points_model_id = points_model_id
         self.templates = self._load_templates()
+        # point class -> list of (rotation angle, rotated template), built on first use
+        self._rotated_templates: Dict[str, List[Tuple[int, np.ndarray]]] = {}
 
         super().__init__(task_id, cache_path)
 
@@ -115,9 +126,111 @@ class PointOrientationExtractor(Task):
         """
         templates = {}
         for point_class, template_path in self.POINT_TEMPLATES.items():
-            templates[point_class] = np.array(Image.open(template_path))
+            # file handle is released as soon as the template pixels are copied out
+            with Image.open(template_path) as im_templ:
+                templates[point_class] = np.array(im_templ)
         return templates
 
+    def _get_rotated_templates(
+        self, point_class: str, task_config: PointOrientationConfig
+    ) -> List[Tuple[int, np.ndarray]]:
+        """
+        Get the bank of pre-processed, rotated and cropped templates for a point class,
+        as a list of (rotation angle, template image).
+        The bank is built on first use and then re-used for all subsequent rasters
+        """
+        if point_class in self._rotated_templates:
+            return self._rotated_templates[point_class]
+
+        # (bbox half-size is an int so bbox_size must = even num)
+        bbox_size = int(task_config.bbox_size / 2) * 2
+
+        # pre-process template image before template matching
+        im_templ, _ = point_extractor_utils.template_pre_processing(
+            self.templates[point_class], np.array([])
+        )
+
+        # convert to gray and get foregnd mask for template
+        _, fore_mask = cv2.threshold(
+            cv2.cvtColor(im_templ, cv2.COLOR_RGB2GRAY),
+            0,
+            255,
+            cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU,
+        )  # TODO could also just crop/re-size the fore mask here too?
+
+        rotated_templates = []
+        for rot_deg in range(0, task_config.rotate_max, task_config.rotate_interval):
+            # get rotated template
+            if rot_deg > 0:
+                im_templ_rot = ndimage.rotate(im_templ, rot_deg, cval=255)
+            else:
+                im_templ_rot = im_templ.copy()
+            # get rotated foregnd mask
+            fore_mask_rot = (
+                ndimage.rotate(fore_mask, rot_deg, cval=0)
+                if rot_deg > 0
+                else fore_mask.copy()
+            )
+            # crop rotated template
+            im_templ_rot = point_extractor_utils.crop_template(
+                im_templ_rot, fore_mask_rot, crop_buffer=5
+            )
+
+            if im_templ_rot.shape[0] > bbox_size or im_templ_rot.shape[1] > bbox_size:
+                # template image cannot be larger than candidate image swatch (will cause an opencv exception)
+                h = min(im_templ_rot.shape[0], bbox_size)
+                w = min(im_templ_rot.shape[1], bbox_size)
+                # TODO ideally this slice should be centered!
+                im_templ_rot = im_templ_rot[0:h, 0:w]
+            rotated_templates.append((rot_deg, im_templ_rot))
+
+        self._rotated_templates[point_class] = rotated_templates
+        return rotated_templates
+
+    def _best_orientation(
+        self,
+        im_thumbnail: np.ndarray,
+        rotated_templates: List[Tuple[int, np.ndarray]],
+        task_config: PointOrientationConfig,
+    ) -> Tuple[float, int]:
+        """
+        Template match a point symbol thumbnail against the rotated templates,
+        and return the (x-corr value, rotation angle) of the best match
+        """
+
+        def match(rot_deg: int, im_templ_rot: np.ndarray) -> float:
+            logger.debug("template rotation: %d", rot_deg)
+            max_val, _ = point_extractor_utils.template_matching(
+                im_thumbnail, im_templ_rot, task_config.xcorr_search_range
+            )
+            return max_val
+
+        step = task_config.rotate_coarse_interval // task_config.rotate_interval
+        if step <= 1:
+            # full sweep; only the running best match is kept
+            best = (0.0, 0)
+            for i, (rot_deg, im_templ_rot) in enumerate(rotated_templates):
+                max_val = match(rot_deg, im_templ_rot)
+                # lowest angle wins on ties
+                if i == 0 or max_val > best[0]:
+                    best = (max_val, rot_deg)
+            return best
+
+        # coarse sweep, then refine around the best coarse angle
+        num_rot = len(rotated_templates)
+        scores = {}  # rotated template index -> x-corr value
+        for i in range(0, num_rot, step):
+            scores[i] = match(*rotated_templates[i])
+        i_coarse = max(sorted(scores), key=lambda i: scores[i])
+        for i in range(i_coarse - step + 1, i_coarse + step):
+            i = i % num_rot
+            if i not in scores:
+                scores[i] = match(*rotated_templates[i])
+
+        # best orientation match for this point symbol location (lowest angle wins on ties)
+        i_best = max(sorted(scores), key=lambda i: scores[i])
+        return (scores[i_best], rotated_templates[i_best][0])
+
     def _dip_magnitude_extraction(
         self,
         matches: List,
@@ -254,7 +367,6 @@ class PointOrientationExtractor(Task):
             matches = match_candidates[c]
             task_config = self.POINT_CONFIGS[c]  # task config for this point class
             bbox_half = int(task_config.bbox_size / 2)
-            bbox_size = bbox_half * 2  # (bbox_half = int so bbox_size must = even num)
             logger.info(
                 f"Performing point orientation analysis for {len(matches)} point symbols of class {c}"
             )
@@ -273,75 +385,35 @@ class PointOrientationExtractor(Task):
                     map_point_labels.labels[idx].dip = dip_angle
 
             # --- 2. estimate symbol orientation (using template matching)
-            # pre-process template image before template matching
-            im_templ, _ = point_extractor_utils.template_pre_processing(
-                self.templates[c], np.array([])
-            )
-
-            # convert to gray and get foregnd mask for template
-            _, fore_mask = cv2.threshold(
-                cv2.cvtColor(im_templ, cv2.COLOR_RGB2GRAY),
-                0,
-                255,
-                cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU,
-            )  # TODO could also just crop/re-size the fore mask here too?
-
-            # --- template matching
-            # loop through rotational intervals...
-            xcorr_results = {}
-            for rot_deg in range(
-                0, task_config.rotate_max, task_config.rotate_interval
-            ):
-                logger.debug("template rotation: {}".format(rot_deg))
-                # get rotated template
-                if rot_deg > 0:
-                    im_templ_rot = ndimage.rotate(im_templ, rot_deg, cval=255)
-                else:
-                    im_templ_rot = im_templ.copy()
-                # get rotated foregnd mask
-                fore_mask_rot = (
-                    ndimage.rotate(fore_mask, rot_deg, cval=0)
-                    if rot_deg > 0
-                    else fore_mask.copy()
+            rotated_templates = self._get_rotated_templates(c, task_config)
+
+            # --- loop through all point locations, and check all rotational intervals for each...
+            # opencv template matching releases the GIL, so points are matched on a thread pool
+            def match_point(map_pt_label: PointLabel) -> Tuple[float, int]:
+                # get thumbnail image around predicted point symbol
+                # (extracted once per point, and re-used for all template rotations)
+                xc = int((map_pt_label.x2 + map_pt_label.x1) / 2)
+                yc = int((map_pt_label.y2 + map_pt_label.y1) / 2)
+                im_thumbnail = im_preproc[
+                    yc - bbox_half : yc + bbox_half, xc - bbox_half : xc + bbox_half
+                ]
+                return self._best_orientation(
+                    im_thumbnail, rotated_templates, task_config
                 )
-                # crop rotated template
-                im_templ_rot = point_extractor_utils.crop_template(
-                    im_templ_rot, fore_mask_rot, crop_buffer=5
-                )
-
-                if (
-                    im_templ_rot.shape[0] > bbox_size
-                    or im_templ_rot.shape[1] > bbox_size
-                ):
-                    # template image cannot be larger than candidate image swatch (will cause an opencv exception)
-                    h = min(im_templ_rot.shape[0], bbox_size)
-                    w = min(im_templ_rot.shape[1], bbox_size)
-                    # TODO ideally this slice should be centered!
-                    im_templ_rot = im_templ_rot[0:h, 0:w]
 
-                # --- loop through all point locations and do template matching for this angle...
-                for pt_idx, map_pt_label in matches:
-                    # get thumbnail image around predicted point symbol
-                    xc = int((map_pt_label.x2 + map_pt_label.x1) / 2)
-                    yc = int((map_pt_label.y2 + map_pt_label.y1) / 2)
-                    im_thumbnail = im_preproc[
-                        yc - bbox_half : yc + bbox_half, xc - bbox_half : xc + bbox_half
-                    ]
-
-                    max_val, max_idx = point_extractor_utils.template_matching(
-                        im_thumbnail, im_templ_rot, task_config.xcorr_search_range
-                    )
-
-                    # update the 'best' orientation match for this point symbol location
-                    if pt_idx in xcorr_results:
-                        if max_val > xcorr_results[pt_idx][0]:
-                            xcorr_results[pt_idx] = (max_val, rot_deg)
-                    else:
-                        xcorr_results[pt_idx] = (max_val, rot_deg)
+            with ThreadPoolExecutor(max_workers=self.MAX_MATCH_WORKERS) as executor:
+                best_matches = executor.map(
+                    match_point, [map_pt_label for _, map_pt_label in matches]
+                )
+                xcorr_results = {
+                    pt_idx: best for (pt_idx, _), best in zip(matches, best_matches)
+                }
             # finished checking all angles
 
             if task_config.mirroring_correction and dip_magnitudes:
                 # --- correct x-corr results based on OCR label position (to prevent 180-deg mirror confusion)...
+                dip_pt_idxs = []
+                ocr_degs = []
                 for pt_idx, map_pt_label in matches:
                     if pt_idx in dip_magnitudes:
                         # get center location of dip label associated with this point
@@ -349,8 +421,6 @@ class PointOrientationExtractor(Task):
                         # get center location of point symbol
                         xc = int((map_pt_label.x2 + map_pt_label.x1) / 2)
                         yc = int((map_pt_label.y2 + map_pt_label.y1) / 2)
-                        # get current point orientation angle
-                        (max_val, rot_deg) = xcorr_results[pt_idx]
 
                         xc_ocr -= xc
                         yc_ocr -= yc
@@ -358,17 +428,26 @@ class PointOrientationExtractor(Task):
                         ocr_deg = math.atan2(yc_ocr, xc_ocr) * 180 / math.pi
                         if ocr_deg < 0:
                             ocr_deg += 360
-                        if not point_extractor_utils.angle_in_range(
-                            ocr_deg, rot_deg, rot_deg + 180
-                        ):
-                            # possible orientation mirroring confusion!
-                            rot_deg_corr = rot_deg - 180
-                            if rot_deg_corr < 0:
-                                rot_deg_corr += 360
-                            xcorr_results[pt_idx] = (max_val, rot_deg_corr)
-                            logger.debug(
-                                f"Correcting angle for symbol index {pt_idx}, was {rot_deg}, now {rot_deg_corr}"
-                            )
+                        dip_pt_idxs.append(pt_idx)
+                        ocr_degs.append(ocr_deg)
+
+                # check the OCR label directions against all current point orientation angles at once
+                rot_degs = np.array(
+                    [xcorr_results[pt_idx][1] for pt_idx in dip_pt_idxs]
+                )
+                in_range = point_extractor_utils.angles_in_range(
+                    np.array(ocr_degs), rot_degs, rot_degs + 180
+                )
+                for pt_idx in np.array(dip_pt_idxs)[~in_range].tolist():
+                    # possible orientation mirroring confusion!
+                    (max_val, rot_deg) = xcorr_results[pt_idx]
+                    rot_deg_corr = rot_deg - 180
+                    if rot_deg_corr < 0:
+                        rot_deg_corr += 360
+                    xcorr_results[pt_idx] = (max_val, rot_deg_corr)
+                    logger.debug(
+                        f"Correcting angle for symbol index {pt_idx}, was {rot_deg}, now {rot_deg_corr}"
+                    )
 
             # save "best orientation angle" results for this point class
             for idx, (_, best_angle) in xcorr_results.items():
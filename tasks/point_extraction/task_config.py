@@ -14,6 +14,10 @@ class PointOrientationConfig(BaseModel):
 
     rotate_interval: int = 5  # [deg] rotational interval for template matching
     rotate_max: int = 360  # [deg] max degrees for rotation analysis
+    # [deg] optional coarse rotational interval (a multiple of rotate_interval) for a
+    # coarse-to-fine angle search; the best coarse angle is then refined at rotate_interval
+    # (0 = disabled, do a full sweep at rotate_interval)
+    rotate_coarse_interval: int = 0
     bbox_size: int = 75  # [pixels] bounding-box size for symbol orientation analysis
 
     # [pixels] template cross-correlation search range (around point center)
@@ -439,6 +439,8 @@ class TemplateMatchPointExtractor(Task):
         """
         pt_labels = []
         bbox_half = bbox_size / 2
+        # note: using hash(label) as class numeric ID
+        class_id = hash(label)
         for x, y, xcorr in matches:
             # generate bboxes around center pt (arbitrary size)
             if map_roi:
@@ -449,18 +451,18 @@ class TemplateMatchPointExtractor(Task):
             x2 = int(x + bbox_half)
             y2 = int(y + bbox_half)
             # prepare final result label
-            # note: using hash(label) as class numeric ID
+            # fields are already cast to the expected types, so skip validation
             pt_labels.append(
-                PointLabel(
+                PointLabel.model_construct(
                     classifier_name=MODEL_NAME,
                     classifier_version=MODEL_VER,
-                    class_id=hash(label),
+                    class_id=class_id,
                     class_name=label,
                     x1=x1,
                     y1=y1,
                     x2=x2,
                     y2=y2,
-                    score=xcorr / 255.0,
+                    score=float(xcorr / 255.0),
                 )
             )
 
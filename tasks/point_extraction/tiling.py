@@ -169,25 +169,31 @@ class Tiler(Task):
                 # empty or invalid ROI bounds
                 continue
             (x_min, y_min, x_max, y_max) = bounds
+            x_starts = range(x_min, x_max, step_x)
+            y_starts = range(y_min, y_max, step_y)
+            if len(x_starts) == 0 or len(y_starts) == 0:
+                continue
 
-            for y in range(y_min, y_max, step_y):
-                for x in range(x_min, x_max, step_x):
-                    width = min(self.tile_size[0], x_max - x)
-                    height = min(self.tile_size[1], y_max - y)
-
-                    tile_array = image_array[y : y + height, x : x + width]  # type: ignore
-
-                    if (
-                        tile_array.shape[0] < self.tile_size[1]
-                        or tile_array.shape[1] < self.tile_size[0]
-                    ):
-                        padded_tile = np.zeros(
-                            (self.tile_size[1], self.tile_size[0], 3),
-                            dtype=tile_array.dtype,
-                        )
+            # pad the ROI area once (at its right and bottom edges) to cover the last row and column of tiles,
+            # so each tile is just a slice of the padded ROI array
+            roi_array = image_array[y_min:y_max, x_min:x_max]
+            pad_x = max(
+                x_starts[-1] - x_min + self.tile_size[0] - roi_array.shape[1], 0
+            )
+            pad_y = max(
+                y_starts[-1] - y_min + self.tile_size[1] - roi_array.shape[0], 0
+            )
+            if pad_x > 0 or pad_y > 0:
+                roi_array = cv2.copyMakeBorder(
+                    roi_array, 0, pad_y, 0, pad_x, cv2.BORDER_CONSTANT, value=0
+                )
 
-                        padded_tile[:height, :width] = tile_array
-                        tile_array = padded_tile
+            for y in y_starts:
+                for x in x_starts:
+                    tile_array = roi_array[
+                        y - y_min : y - y_min + self.tile_size[1],
+                        x - x_min : x - x_min + self.tile_size[0],
+                    ]
 
                     maptile = ImageTile(
                         x_offset=x,
@@ -286,61 +292,58 @@ class Untiler(Task):
         overlap_predictions = {}
         num_dedup = 0
         map_path = image_tiles.tiles[0].image_path if len(image_tiles.tiles) > 0 else ""
-        for tile in image_tiles.tiles:
+        for tile in tqdm(
+            image_tiles.tiles,
+            desc="Reconstructing original image with predictions on tiles",
+        ):
+            if not tile.predictions:
+                continue
 
             x_offset = tile.x_offset  # xmin of tile, absolute value in original map
             y_offset = tile.y_offset  # ymin of tile, absolute value in original map
 
-            for pred in tqdm(
-                tile.predictions,
-                desc="Reconstructing original image with predictions on tiles",
-            ):
-
-                x1 = pred.x1
-                x2 = pred.x2
-                y1 = pred.y1
-                y2 = pred.y2
-                score = pred.score
-                label_name = pred.class_name
-
-                # filter noisy predictions due to tile overlap
-                pred_redundant = False
-                pred_in_overlap = False
-                if self.overlap[0] > 0 or self.overlap[1] > 0:
-                    pred_redundant, pred_in_overlap = self._is_prediction_redundant(
-                        pred,
-                        image_tiles.roi_bounds,
-                        (tile.x_offset, tile.y_offset),
-                        (tile.width, tile.height),
-                    )
-
-                if pred_redundant:
-                    continue
-
-                global_prediction = PointLabel(
+            # redundancy and overlap checks are done for all of the tile's predictions at once
+            bboxes = np.array(
+                [(pred.x1, pred.y1, pred.x2, pred.y2) for pred in tile.predictions],
+                dtype=np.int64,
+            )
+            scores = np.array([pred.score for pred in tile.predictions])
+            if self.overlap[0] > 0 or self.overlap[1] > 0:
+                preds_redundant, preds_in_overlap = self._find_redundant_predictions(
+                    bboxes,
+                    scores,
+                    image_tiles.roi_bounds,
+                    (x_offset, y_offset),
+                    (tile.width, tile.height),
+                )
+            else:
+                preds_redundant = np.zeros(len(bboxes), dtype=bool)
+                preds_in_overlap = preds_redundant
+            # de-dup keys for predictions in overlapped tile regions (decimated global bbox centers)
+            centers = (bboxes[:, :2] + bboxes[:, 2:]) / 2 + (x_offset, y_offset)
+            center_keys = (centers * DEDUP_DECIMATION_FACTOR).astype(np.int64).tolist()
+
+            for i in np.flatnonzero(~preds_redundant).tolist():
+                pred = tile.predictions[i]
+                # fields come from an already validated prediction, so skip validation
+                global_prediction = PointLabel.model_construct(
                     classifier_name=pred.classifier_name,
                     classifier_version=pred.classifier_version,
                     class_id=pred.class_id,
-                    class_name=label_name,
+                    class_name=pred.class_name,
                     # Add offset of tile to project onto original map...
-                    x1=x1 + x_offset,
-                    y1=y1 + y_offset,
-                    x2=x2 + x_offset,
-                    y2=y2 + y_offset,
-                    score=score,
+                    x1=pred.x1 + x_offset,
+                    y1=pred.y1 + y_offset,
+                    x2=pred.x2 + x_offset,
+                    y2=pred.y2 + y_offset,
+                    score=pred.score,
                     direction=pred.direction,
                     dip=pred.dip,
                 )
 
-                if pred_in_overlap:
+                if preds_in_overlap[i]:
                     # store predictions in overlapped tile regions in a dict, to de-duplicate as needed
-                    xc_idx = ((x1 + x2) / 2) + x_offset
-                    yc_idx = ((y1 + y2) / 2) + y_offset
-                    pred_key = (
-                        label_name,
-                        int(xc_idx * DEDUP_DECIMATION_FACTOR),
-                        int(yc_idx * DEDUP_DECIMATION_FACTOR),
-                    )
+                    pred_key = (pred.class_name, *center_keys[i])
                     if pred_key in overlap_predictions:
                         # duplicate prediction will be overwritten here
                         num_dedup += 1
@@ -357,60 +360,54 @@ class Untiler(Task):
 
         return PointLabels(path=map_path, raster_id=raster_id, labels=all_predictions)
 
-    def _is_prediction_redundant(
+    def _find_redundant_predictions(
         self,
-        pred: PointLabel,
+        bboxes: np.ndarray,
+        scores: np.ndarray,
         roi_bbox,
         tile_offset: tuple,
         tile_wh: tuple,
         shape_thres=2,
         conf_thres=0.5,
-    ) -> tuple:
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Check if a point symbol prediction is redundant
+        Check which point symbol predictions in a tile are redundant
         (based on heuristic of bbox shape and location at tile edge)
+
+        bboxes are an (N, 4) array of tile-local x1, y1, x2, y2 and scores an (N,) array;
+        returns (N,) boolean arrays of (pred_redundant, pred_in_overlap)
         """
-        x1 = pred.x1
-        x2 = pred.x2
-        y1 = pred.y1
-        y2 = pred.y2
+        x1, y1, x2, y2 = bboxes.T
         (roi_xmin, roi_ymin, roi_xmax, roi_ymax) = roi_bbox
         tile_w, tile_h = tile_wh
         x_offset, y_offset = tile_offset
 
-        pred_redundant = False
-        pred_in_overlap = False
         xc = (x1 + x2) / 2
         yc = (y1 + y2) / 2
         # check if the prediction is in a region where multiple tiles overlap
-        if (
-            xc < self.overlap[0]
-            or xc > tile_wh[0] - self.overlap[0]
-            or yc < self.overlap[1]
-            or yc > tile_wh[1] - self.overlap[1]
-        ):
-            pred_in_overlap = True
+        preds_in_overlap = (
+            (xc < self.overlap[0])
+            | (xc > tile_wh[0] - self.overlap[0])
+            | (yc < self.overlap[1])
+            | (yc > tile_wh[1] - self.overlap[1])
+        )
 
         # TODO - instead of checking at tile edge could check if bbox edge is in overlap region
-        if (abs((x2 - x1) - (y2 - y1)) > shape_thres) and (
-            x1 <= 1 or y1 <= 1 or x2 >= tile_w - 1 or y2 >= tile_h - 1
-        ):
-            # pred bbox is at a tile edge and NOT square,
-            # check if bbox edges correspond to global image bounds
-            if (
-                x1 + x_offset > roi_xmin
-                and x2 + x_offset < roi_xmax
-                and y1 + y_offset > roi_ymin
-                and y2 + y_offset < roi_ymax
-            ):
-                # non-square point bbox not at map edges, assume this is a noisy prediction (due to tile overlap) and skip
-                pred_redundant = True
-            elif pred.score < conf_thres:
-                # non-square point bbox at map edges, and low confidence,
-                # discard as a redundant or noisy prediction
-                pred_redundant = True
-
-        return (pred_redundant, pred_in_overlap)
+        # pred bbox is at a tile edge and NOT square...
+        at_tile_edge = (np.abs((x2 - x1) - (y2 - y1)) > shape_thres) & (
+            (x1 <= 1) | (y1 <= 1) | (x2 >= tile_w - 1) | (y2 >= tile_h - 1)
+        )
+        # ...and either not at map edges (assume this is a noisy prediction due to tile overlap),
+        # or at map edges but low confidence (discard as a redundant or noisy prediction)
+        inside_roi = (
+            (x1 + x_offset > roi_xmin)
+            & (x2 + x_offset < roi_xmax)
+            & (y1 + y_offset > roi_ymin)
+            & (y2 + y_offset < roi_ymax)
+        )
+        preds_redundant = at_tile_edge & (inside_roi | (scores < conf_thres))
+
+        return (preds_redundant, preds_in_overlap)
 
     @property
     def input_type(self):
@@ -1,5 +1,6 @@
 import logging
 import math
+from collections import defaultdict
 
 from shapely import MultiPolygon
 from tasks.common.task import TaskInput
@@ -21,13 +22,16 @@ def rank_segments(segmentation: MapSegmentation, class_labels: List):
     """
     Post-process the segmentation result, by ranking segments per class
     """
+    # group segments by class label in a single pass
+    segments_by_label = defaultdict(list)
+    for s in segmentation.segments:
+        segments_by_label[s.class_label].append(s)
+
     segments_out = []
     # loop through segmenter class labels, and de-noise / rank segments per class
     for label in class_labels:
-        segments = list(
-            filter(lambda s: (s.class_label == label), segmentation.segments)
-        )
-        if len(segments) == 0:
+        segments = segments_by_label.get(label)
+        if not segments:
             continue
         # rank the segments by heuristic of confidence x sqrt(area)
         segments.sort(key=lambda s: (s.confidence * math.sqrt(s.area)), reverse=True)
@@ -1,4 +1,5 @@
-from google.cloud.vision import ImageAnnotatorClient
+from google.cloud.vision import AnnotateImageRequest, Feature, ImageAnnotatorClient
+from google.cloud.vision import AnnotateImageResponse
 from google.cloud.vision import Image as VisionImage
 from google.cloud.vision_v1.types.geometry import BoundingPoly, Vertex
 from PIL.Image import Image as PILImage
@@ -6,11 +7,19 @@ import cv2 as cv
 import numpy as np
 import io, copy, logging
 from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from shapely.geometry import Polygon
 from shapely import MultiPolygon, unary_union, concave_hull
 
 logger = logging.getLogger(__name__)
 
+# limits for a single batch_annotate_images request
+MAX_BATCH_IMAGES = 16  # max images per request (Google Vision API limit)
+# max total image content per request (kept under the API request size limit)
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+# max concurrent OCR API requests
+MAX_OCR_WORKERS = 8
+
 
 class GoogleVisionOCR:
     """
@@ -33,6 +42,83 @@ class GoogleVisionOCR:
         client = ImageAnnotatorClient()
         response = client.text_detection(image=vision_img)  # type: ignore
 
+        return self._parse_text_response(response)
+
+    def detect_text_batch(
+        self, vision_imgs: List[VisionImage], document_ocr: bool = False
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Runs google vision OCR on multiple images, batching the images into as few API calls as possible
+
+        Args:
+            vision_imgs: input images (google vision Image class)
+            document_ocr: use document text detection, instead of text detection
+
+        Returns:
+            List of text extractions per input image, in the same format as `detect_text`
+            (or `detect_document_text`, if document_ocr is True)
+        """
+        feature_type = (
+            Feature.Type.DOCUMENT_TEXT_DETECTION
+            if document_ocr
+            else Feature.Type.TEXT_DETECTION
+        )
+        parse_response = (
+            self._parse_document_response if document_ocr else self._parse_text_response
+        )
+
+        client = ImageAnnotatorClient()
+
+        def annotate_batch(batch: List[VisionImage]) -> List[AnnotateImageResponse]:
+            requests = [
+                AnnotateImageRequest(image=img, features=[Feature(type_=feature_type)])
+                for img in batch
+            ]
+            return list(client.batch_annotate_images(requests=requests).responses)
+
+        # the API calls are network-bound, so batches are sent concurrently (results are kept in input order)
+        batches = self._batch_images(vision_imgs)
+        text_extractions: List[List[Dict[str, Any]]] = []
+        with ThreadPoolExecutor(
+            max_workers=max(min(MAX_OCR_WORKERS, len(batches)), 1)
+        ) as executor:
+            for responses in executor.map(annotate_batch, batches):
+                text_extractions.extend(
+                    parse_response(response) for response in responses
+                )
+
+        return text_extractions
+
+    @staticmethod
+    def _batch_images(vision_imgs: List[VisionImage]) -> List[List[VisionImage]]:
+        """
+        Group images into batches that fit under the API's per-request image count and size limits
+        (an image over the size limit is sent in a batch of its own)
+        """
+        batches: List[List[VisionImage]] = []
+        batch: List[VisionImage] = []
+        batch_bytes = 0
+        for img in vision_imgs:
+            img_bytes = len(img.content)
+            if batch and (
+                len(batch) >= MAX_BATCH_IMAGES
+                or batch_bytes + img_bytes > MAX_BATCH_BYTES
+            ):
+                batches.append(batch)
+                batch = []
+                batch_bytes = 0
+            batch.append(img)
+            batch_bytes += img_bytes
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _parse_text_response(
+        self, response: AnnotateImageResponse
+    ) -> List[Dict[str, Any]]:
+        """
+        Parse the text annotations from a google vision text detection response
+        """
         text_extractions: List[Dict[str, Any]] = []
         if response.text_annotations:
             # note: first entry will be the entire text block
@@ -47,13 +133,7 @@ class GoogleVisionOCR:
         else:
             logger.warning("No OCR text found!")
 
-        if response.error.message:
-            raise Exception(
-                "{}\nFor more info on error messages, check: "
-                "https://cloud.google.com/apis/design/errors".format(
-                    response.error.message
-                )
-            )
+        self._check_response_error(response)
 
         return text_extractions
 
@@ -156,6 +236,14 @@ class GoogleVisionOCR:
         client = ImageAnnotatorClient()
         response = client.document_text_detection(image=vision_img)  # type: ignore
 
+        return self._parse_document_response(response)
+
+    def _parse_document_response(
+        self, response: AnnotateImageResponse
+    ) -> List[Dict[str, Any]]:
+        """
+        Parse the text blocks from a google vision document text detection response
+        """
         text_extractions = []
         if response.full_text_annotation:
             for page in response.full_text_annotation.pages:
@@ -178,6 +266,15 @@ class GoogleVisionOCR:
         else:
             logger.warning("No OCR text found!")
 
+        self._check_response_error(response)
+
+        return text_extractions
+
+    @staticmethod
+    def _check_response_error(response: AnnotateImageResponse) -> None:
+        """
+        Raise an exception if a google vision response contains an error
+        """
         if response.error.message:
             raise Exception(
                 "{}\nFor more info on error messages, check: "
@@ -186,8 +283,6 @@ class GoogleVisionOCR:
                 )
             )
 
-        return text_extractions
-
     def _add_bounding_polygons(
         self, poly1: Optional[BoundingPoly], poly2: Optional[BoundingPoly]
     ) -> Optional[BoundingPoly]:
@@ -243,8 +338,10 @@ class GoogleVisionOCR:
         if not text_blocks or resize_factor == 1.0:
             return text_blocks
         # TODO could add a check that any bounding_poly coords are within original image boundaries
+        # (vertices are updated on the underlying protobuf messages, which is much faster than
+        # going through the proto-plus wrappers one vertex at a time)
         for blk in text_blocks:
-            for v in blk["bounding_poly"].vertices:
+            for v in BoundingPoly.pb(blk["bounding_poly"]).vertices:
                 v.x = int(v.x * resize_factor)
                 v.y = int(v.y * resize_factor)
 
@@ -261,7 +358,7 @@ class GoogleVisionOCR:
         if not text_blocks or not offset:
             return text_blocks
         for blk in text_blocks:
-            for v in blk["bounding_poly"].vertices:
+            for v in BoundingPoly.pb(blk["bounding_poly"]).vertices:
                 v.x = int(v.x + offset[0])
                 v.y = int(v.y + offset[1])
 
@@ -0,0 +1,36 @@
+from google.cloud.vision import Image as VisionImage
+from tasks.text_extraction.ocr import google_vision_ocr
+from tasks.text_extraction.ocr.google_vision_ocr import (
+    GoogleVisionOCR,
+    MAX_BATCH_IMAGES,
+)
+
+
+def test_batch_images_count_limit():
+    vision_imgs = [VisionImage(content=b"img") for _ in range(2 * MAX_BATCH_IMAGES + 3)]
+
+    batches = GoogleVisionOCR._batch_images(vision_imgs)
+
+    assert [len(batch) for batch in batches] == [MAX_BATCH_IMAGES, MAX_BATCH_IMAGES, 3]
+    # input order is preserved across batches
+    assert [img for batch in batches for img in batch] == vision_imgs
+
+
+def test_batch_images_size_limit(monkeypatch):
+    monkeypatch.setattr(google_vision_ocr, "MAX_BATCH_BYTES", 10)
+    sizes = [4, 4, 4, 20, 1]
+    vision_imgs = [VisionImage(content=b"x" * size) for size in sizes]
+
+    batches = GoogleVisionOCR._batch_images(vision_imgs)
+
+    # an image over the size limit is sent in a batch of its own
+    assert [[len(img.content) for img in batch] for batch in batches] == [
+        [4, 4],
+        [4],
+        [20],
+        [1],
+    ]
+
+
+def test_batch_images_empty():
+    assert GoogleVisionOCR._batch_images([]) == []
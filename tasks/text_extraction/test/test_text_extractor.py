@@ -1,11 +1,37 @@
 from tasks.text_extraction.text_extractor import ResizeTextExtractor, TileTextExtractor
-from tasks.text_extraction.entities import DocTextExtraction
+from tasks.text_extraction.entities import (
+    DocTextExtraction,
+    TEXT_EXTRACTION_OUTPUT_KEY,
+)
+from tasks.text_extraction.ocr.google_vision_ocr import GoogleVisionOCR
 from tasks.common import image_io
+from google.cloud.vision_v1.types.geometry import BoundingPoly, Vertex
 from pathlib import Path
+from PIL import Image
 from tasks.common.task import TaskInput
 import pytest
 
 
+def create_tile_extractor(
+    monkeypatch, stride_ratio: float, cache_location: str = ""
+) -> TileTextExtractor:
+    # skip the vision api key check, so no credentials are needed
+    monkeypatch.setattr(GoogleVisionOCR, "validate_api_key", lambda self: None)
+    return TileTextExtractor(
+        "tile_text", cache_location, 100, stride_ratio=stride_ratio
+    )
+
+
+def create_ocr_block(text: str, x_min: int, y_min: int, x_max: int, y_max: int):
+    vertices = [
+        Vertex(x=x_min, y=y_min),
+        Vertex(x=x_max, y=y_min),
+        Vertex(x=x_max, y=y_max),
+        Vertex(x=x_min, y=y_max),
+    ]
+    return {"text": text, "bounding_poly": BoundingPoly(vertices=vertices)}
+
+
 @pytest.mark.skip(reason="requires google vision credentials")
 def test_resize_text_extractor():
     """
@@ -130,3 +156,124 @@ def validate_tile_extractions(doc_text_extraction: DocTextExtraction) -> None:
     assert extraction.bounds[2].y == 46
     assert extraction.bounds[3].x == 3
     assert extraction.bounds[3].y == 45
+
+
+def test_get_splits_no_overlap(monkeypatch):
+    tte = create_tile_extractor(monkeypatch, 1.0)
+
+    assert tte._get_splits(250, 100) == [(0, 84), (84, 168), (168, 250)]
+    assert tte._get_splits(80, 100) == [(0, 80)]
+
+
+def test_get_splits_overlap(monkeypatch):
+    tte = create_tile_extractor(monkeypatch, 0.5)
+    splits = tte._get_splits(250, 100)
+
+    # tiles are the same length as with no overlap, but start every half tile
+    assert splits == [(0, 84), (42, 126), (84, 168), (126, 210), (168, 250)]
+
+    # the tiles cover the full image, with the last tile clipped to the image edge
+    assert splits[0][0] == 0
+    assert splits[-1][1] == 250
+    for (start, end), (next_start, _) in zip(splits, splits[1:]):
+        assert next_start < end
+    assert all(end - start <= 100 for start, end in splits)
+
+
+def test_dedup_ocr_blocks(monkeypatch):
+    tte = create_tile_extractor(monkeypatch, 0.5)
+    ocr_blocks = [
+        # the same text OCR'd in the overlap of two tiles - the larger block is kept
+        create_ocr_block("BANDERSNATCH", 10, 10, 100, 30),
+        create_ocr_block("BANDERSNAT", 10, 10, 90, 30),
+        # overlapping blocks from the same tile are both kept
+        create_ocr_block("FUMIOUS", 200, 200, 260, 220),
+        create_ocr_block("FUMIOUS BANDERSNATCH", 200, 200, 280, 220),
+        # a small overlap between tiles is not a duplicate
+        create_ocr_block("JABBERWOCK", 300, 300, 350, 320),
+        create_ocr_block("JUBJUB", 340, 300, 400, 320),
+    ]
+    tile_idxs = [0, 1, 2, 2, 2, 3]
+
+    deduped = tte._dedup_ocr_blocks(ocr_blocks, tile_idxs)
+
+    assert [block["text"] for block in deduped] == [
+        "BANDERSNATCH",
+        "FUMIOUS",
+        "FUMIOUS BANDERSNATCH",
+        "JABBERWOCK",
+        "JUBJUB",
+    ]
+
+
+def test_extract_text_batch_duplicate_images(monkeypatch):
+    tte = create_tile_extractor(monkeypatch, 1.0)
+    ocr_calls = []
+
+    def detect_text_batch(vision_imgs, document_ocr=False):
+        ocr_calls.append(len(vision_imgs))
+        return [
+            [create_ocr_block(f"TEXT {i}", 0, 0, 10, 10)]
+            for i in range(len(vision_imgs))
+        ]
+
+    monkeypatch.setattr(tte._ocr, "detect_text_batch", detect_text_batch)
+    monkeypatch.setattr(tte._ocr, "text_to_blocks", lambda texts: texts)
+
+    blank = Image.new("RGB", (32, 32), color="white")
+    ims = [blank, Image.new("RGB", (32, 32), color="red"), blank.copy(), blank]
+
+    ocr_texts = tte._extract_text_batch(ims)
+
+    # each distinct image is only OCR'd once
+    assert ocr_calls == [2]
+    assert [[block["text"] for block in texts] for texts in ocr_texts] == [
+        ["TEXT 0"],
+        ["TEXT 1"],
+        ["TEXT 0"],
+        ["TEXT 0"],
+    ]
+
+    # duplicates get their own copies of the results, so they can be modified in place
+    assert ocr_texts[2] is not ocr_texts[0]
+    assert ocr_texts[2][0] is not ocr_texts[0][0]
+    assert ocr_texts[3][0]["bounding_poly"] is not ocr_texts[0][0]["bounding_poly"]
+    GoogleVisionOCR.offset_ocr_coords(ocr_texts[2], (100, 100))
+    assert ocr_texts[2][0]["bounding_poly"].vertices[0].x == 100
+    assert ocr_texts[0][0]["bounding_poly"].vertices[0].x == 0
+
+
+def test_cached_extraction_for_identical_image(monkeypatch, tmp_path):
+    tte = create_tile_extractor(monkeypatch, 1.0, str(tmp_path))
+    ocr_calls = []
+
+    def detect_text_batch(vision_imgs, document_ocr=False):
+        ocr_calls.append(len(vision_imgs))
+        return [[create_ocr_block("FUMIOUS", 4, 9, 89, 22)] for _ in vision_imgs]
+
+    monkeypatch.setattr(tte._ocr, "detect_text_batch", detect_text_batch)
+    monkeypatch.setattr(tte._ocr, "text_to_blocks", lambda texts: texts)
+
+    image = Image.new("RGB", (64, 64), color="white")
+    input = TaskInput(0)
+    input.image = image
+    input.raster_id = "map_a"
+    tte.run(input)
+    assert ocr_calls == [1]
+
+    # the same image under a new raster id misses on the raster key, but hits on the content key
+    input.raster_id = "map_b"
+    result = tte.run(input)
+    doc_text_extraction = DocTextExtraction.model_validate(
+        result.output[TEXT_EXTRACTION_OUTPUT_KEY]
+    )
+
+    assert ocr_calls == [1]
+    doc_key = f"map_b_{tte._model_id}_{tte._gamma_correction}"
+    assert doc_text_extraction.doc_id == doc_key
+    assert [e.text for e in doc_text_extraction.extractions] == ["FUMIOUS"]
+
+    # the results are re-keyed and saved under the new raster id
+    cached = DocTextExtraction.model_validate(tte.fetch_cached_result(doc_key))
+    assert cached.doc_id == doc_key
+    assert (tmp_path / f"{doc_key}.json").exists()
@@ -1,12 +1,17 @@
+import os
 import sys
+import copy
 import numpy as np
 import logging
-from math import ceil
-from typing import Tuple, List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, List, Dict, Any, Optional
 from PIL import Image
 from PIL.Image import Image as PILImage
 import cv2
 import requests
+from google.cloud.vision_v1.types.geometry import BoundingPoly
+from shapely.geometry import box
+from shapely.strtree import STRtree
 from .ocr.google_vision_ocr import GoogleVisionOCR
 from .entities import (
     DocTextExtraction,
@@ -15,6 +20,7 @@ from .entities import (
     Tile,
     TEXT_EXTRACTION_OUTPUT_KEY,
 )
+from ..common.image_io import image_content_hash
 from ..common.task import Task, TaskInput, TaskResult
 
 PIXEL_LIM_DEFAULT = 6000  # default max pixel limit for input image (determines amount of image resizing)
@@ -23,6 +29,11 @@ PIXEL_LIM_DEFAULT = 6000  # default max pixel limit for input image (determines
 # NOTE: gamma = 0.5 recommended for OCR pre-processing
 GAMMA_CORR_DEFAULT = 1.0
 
+# default tile stride, as a ratio of the tile size; =1 no tile overlap; <1 overlapping tiles
+STRIDE_RATIO_DEFAULT = 1.0
+# OCR blocks from different overlapping tiles with IoU above this threshold are considered duplicates
+OCR_DEDUP_IOU_THRES = 0.5
+
 logger = logging.getLogger(__name__)
 
 
@@ -31,6 +42,9 @@ class TextExtractor(Task):
     Base class for OCR-based text extraction
     """
 
+    # max number of threads for encoding images prior to OCR
+    MAX_ENCODE_WORKERS = os.cpu_count()
+
     def __init__(
         self,
         task_id: str,
@@ -50,14 +64,16 @@ class TextExtractor(Task):
         self._output_key = output_key
         self._metrics_url = metrics_url
 
-        # init gamma correction look up table
-        self._gamma_lut = np.empty((1, 256), np.uint8)
+        # init gamma correction look up table (only needed if gamma correction is enabled)
+        self._gamma_lut: Optional[np.ndarray] = None
         if self._gamma_correction != 1.0:
             # from https://docs.opencv.org/4.x/d3/dc1/tutorial_basic_linear_transform.html
-            for i in range(256):
-                self._gamma_lut[0, i] = np.clip(
-                    pow(i / 255.0, self._gamma_correction) * 255.0, 0, 255
-                )
+            self._gamma_lut = np.empty((1, 256), np.uint8)
+            self._gamma_lut[0] = np.clip(
+                np.power(np.arange(256) / 255.0, self._gamma_correction) * 255.0,
+                0,
+                255,
+            )
 
         # validate the vision api key - hard stop if can't be found
         try:
@@ -72,21 +88,18 @@ class TextExtractor(Task):
         """
         Apply image gamma correction prior to OCR
         """
-        logger.info(f"applying gamma correction of {self._gamma_correction} to image")
-        if self._gamma_correction == 1.0:
-            # skip gamma correction
+        if self._gamma_lut is None:
+            # gamma correction disabled
             return img
+        logger.info(f"applying gamma correction of {self._gamma_correction} to image")
 
         # convert image from PIL to opencv (numpy) format --  assumed color channel order is RGB
         im = np.array(img)
 
         im = cv2.cvtColor(im, cv2.COLOR_RGB2LAB)
-        (L, A, B) = cv2.split(im)
-        # apply gamma correction to L channel
-        L_gamma = cv2.LUT(L, self._gamma_lut)
-        # re-merge channels
-        im_gamma = cv2.merge([L_gamma, A, B])
-        im_gamma = cv2.cvtColor(im_gamma, cv2.COLOR_LAB2RGB)
+        # apply gamma correction to L channel (in-place, so no channel split / re-merge is needed)
+        im[:, :, 0] = cv2.LUT(im[:, :, 0], self._gamma_lut)
+        im_gamma = cv2.cvtColor(im, cv2.COLOR_LAB2RGB, dst=im)
 
         return Image.fromarray(im_gamma)
 
@@ -113,6 +126,127 @@ class TextExtractor(Task):
                 self._publish_doc_ocr_metrics()
         return ocr_texts
 
+    def _extract_text_batch(self, ims: List[PILImage]) -> List[List[Dict[str, Any]]]:
+        """
+        Extract text from multiple images using batched Google Vision OCR calls.
+        Args:
+            ims (List[PILImage]): The input images from which text needs to be extracted.
+        Returns:
+            List[List[Dict[str, Any]]]: The extracted text and related information, per input image.
+        """
+
+        if len(ims) > 1:
+            # identical images (e.g., blank map margin tiles) give identical OCR results,
+            # so each distinct image is only sent for OCR once
+            content_keys = [self._content_cache_key(im) for im in ims]
+            unique_ims: Dict[str, PILImage] = {}
+            for content_key, im in zip(content_keys, ims):
+                unique_ims.setdefault(content_key, im)
+            if len(unique_ims) < len(ims):
+                logger.info(
+                    f"Skipping OCR on {len(ims) - len(unique_ims)} duplicate images"
+                )
+                unique_texts = dict(
+                    zip(
+                        unique_ims.keys(),
+                        self._extract_text_batch(list(unique_ims.values())),
+                    )
+                )
+                # callers may modify the OCR results in place (e.g., offsetting coords),
+                # so each duplicate image gets its own copy
+                ocr_texts = []
+                seen_keys = set()
+                for content_key in content_keys:
+                    texts = unique_texts[content_key]
+                    if content_key in seen_keys:
+                        texts = copy.deepcopy(texts)
+                    seen_keys.add(content_key)
+                    ocr_texts.append(texts)
+                return ocr_texts
+
+        if len(ims) > 1:
+            # JPEG encoding is CPU-bound and releases the GIL, so encode the images concurrently
+            with ThreadPoolExecutor(max_workers=self.MAX_ENCODE_WORKERS) as executor:
+                imgs_gv = list(executor.map(GoogleVisionOCR.pil_to_vision_image, ims))
+        else:
+            imgs_gv = [GoogleVisionOCR.pil_to_vision_image(im) for im in ims]
+
+        # ----- do GoogleVision OCR
+        ocr_texts = self._ocr.detect_text_batch(
+            imgs_gv, document_ocr=self._document_ocr
+        )
+        if self._document_ocr:
+            self._publish_image_ocr_metrics(len(ims))
+        elif self._to_blocks:
+            ocr_texts = [self._ocr.text_to_blocks(texts) for texts in ocr_texts]
+            self._publish_doc_ocr_metrics(len(ims))
+        return ocr_texts
+
+    def _content_cache_key(self, image: PILImage) -> str:
+        """
+        Create a cache key from the image's pixel content (independent of the raster id)
+        """
+        content_hash = image_content_hash(image).hex()
+        return f"{self._model_id}_{self._gamma_correction}_content-{content_hash}"
+
+    def _fetch_cached_extraction(
+        self, image: PILImage, doc_key: str
+    ) -> Tuple[Optional[DocTextExtraction], str]:
+        """
+        Fetch cached OCR results for a raster, falling back to cached results for an identical image
+        stored under a different raster id.
+        Returns the cached results (if any) and the image content cache key (if computed)
+        """
+        content_key = ""
+        cached_data = self.fetch_cached_result(doc_key)
+        if not cached_data and self._cache_location:
+            content_key = self._content_cache_key(image)
+            cached_data = self.fetch_cached_result(content_key)
+            if cached_data:
+                logger.info(f"Using cached OCR results for identical image: {doc_key}")
+        if not cached_data:
+            return None, content_key
+
+        doc_text = DocTextExtraction.model_validate(cached_data)
+        if content_key:
+            # re-key the results for this raster, so they are found directly next time
+            doc_text.doc_id = doc_key
+            self.write_result_to_cache(doc_text, doc_key)
+        return doc_text, content_key
+
+    @staticmethod
+    def _ocr_blocks_to_extractions(
+        ocr_blocks: List[Dict[str, Any]]
+    ) -> List[TextExtraction]:
+        """
+        Convert OCR blocks to TextExtraction objects.
+        OCR text and (integer) vertex coords are already typed by the Vision API response,
+        so the models are constructed without re-validating every block and point.
+        (vertices are read from the underlying protobuf message, which is much faster than
+        going through the proto-plus wrappers one vertex at a time)
+        """
+        return [
+            TextExtraction.model_construct(
+                text=ocr_block["text"],
+                confidence=1.0,
+                bounds=[
+                    Point.model_construct(x=vertex.x, y=vertex.y)
+                    for vertex in BoundingPoly.pb(ocr_block["bounding_poly"]).vertices
+                ],
+            )
+            for ocr_block in ocr_blocks
+        ]
+
+    def _write_extraction_to_cache(
+        self, doc_text: DocTextExtraction, doc_key: str, content_key: str
+    ):
+        """
+        Write OCR results to the cache, by raster id and also by image content (if available)
+        """
+        self.write_result_to_cache(doc_text, doc_key)
+        if content_key:
+            self.write_result_to_cache(doc_text, content_key)
+
     def _publish_image_ocr_metrics(self, num_calls=1):
         """
         Publishes Vision image OCR  metrics to the specified metrics URL.
@@ -185,18 +319,18 @@ class ResizeTextExtractor(TextExtractor):
         doc_key = f"{input.raster_id}_{self._model_id}_{self._gamma_correction}"
 
         # check cache and re-use existing file if present
-        cached_data = self.fetch_cached_result(doc_key)
-        if cached_data:
-            # validate the cached data
-            doc_extract = DocTextExtraction.model_validate(cached_data)
+        doc_extract, content_key = self._fetch_cached_extraction(input.image, doc_key)
+        if doc_extract:
             result = self._create_result(input)
             result.add_output(self._output_key, doc_extract.model_dump())
             return result
 
-        # pre-processing: apply gamma correction and re-size image, as needed
-        im_resized, im_resize_ratio = self._resize_image(
-            self._apply_gamma_correction(input.image)
-        )
+        # pre-processing: re-size image and apply gamma correction, as needed
+        # (gamma is applied after down-sizing so the LUT only runs on the smaller image;
+        # since gamma is a monotone per-pixel transform, this only differs slightly at
+        # resampled edges, which doesn't affect OCR)
+        im_resized, im_resize_ratio = self._resize_image(input.image)
+        im_resized = self._apply_gamma_correction(im_resized)
 
         ocr_blocks = self._extract_text(im_resized)
 
@@ -207,21 +341,12 @@ class ResizeTextExtractor(TextExtractor):
             )
 
         # convert output to internal schema
-        texts: List[TextExtraction] = []
-        for ocr_block in ocr_blocks:
-            bounds = [
-                Point(x=vertex.x, y=vertex.y)
-                for vertex in ocr_block["bounding_poly"].vertices
-            ]
-            ocr_result = TextExtraction(
-                text=ocr_block["text"], confidence=1.0, bounds=bounds
-            )
-            texts.append(ocr_result)
+        texts = self._ocr_blocks_to_extractions(ocr_blocks)
 
         doc_text_extraction = DocTextExtraction(doc_id=doc_key, extractions=texts)
 
         # write to cache
-        self.write_result_to_cache(doc_text_extraction, doc_key)
+        self._write_extraction_to_cache(doc_text_extraction, doc_key, content_key)
 
         result = self._create_result(input)
         result.add_output(self._output_key, doc_text_extraction.model_dump())
@@ -242,7 +367,10 @@ class ResizeTextExtractor(TextExtractor):
             reduced_size = int(im_orig_size[0] * im_resize_ratio), int(
                 im_orig_size[1] * im_resize_ratio
             )
-            im = im.resize(reduced_size, Image.Resampling.LANCZOS)
+            # box-reduce first (fast) down to ~3x the target size, and only use the more expensive
+            # LANCZOS resampling for the rest - a gap of 3 keeps small map text as sharp as a plain
+            # LANCZOS resize
+            im = im.resize(reduced_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
 
         return im, im_resize_ratio
 
@@ -260,6 +388,7 @@ class TileTextExtractor(TextExtractor):
         gamma_correction: float = GAMMA_CORR_DEFAULT,
         output_key: str = TEXT_EXTRACTION_OUTPUT_KEY,
         metrics_url: str = "",
+        stride_ratio: float = STRIDE_RATIO_DEFAULT,
     ):
         super().__init__(
             task_id,
@@ -268,8 +397,14 @@ class TileTextExtractor(TextExtractor):
             output_key=output_key,
             metrics_url=metrics_url,
         )
+        if not 0.0 < stride_ratio <= 1.0:
+            raise ValueError(f"stride_ratio must be in (0, 1], got {stride_ratio}")
         self.split_lim = split_lim
+        self.stride_ratio = stride_ratio
         self._model_id += f"_tile-{split_lim}"
+        if stride_ratio < 1.0:
+            # overlapping tiles give different OCR results, so keep them separate in the cache
+            self._model_id += f"_stride-{stride_ratio}"
 
     def run(self, input: TaskInput) -> TaskResult:
         """
@@ -282,18 +417,15 @@ class TileTextExtractor(TextExtractor):
             TaskResult object containing a DocTextExtraction object
         """
 
-        # TODO -- this code could be modified to include overlap/stride len, etc.
-        # (then, any overlapping OCR results need to be de-dup'd)
         if input.image is None:
             return self._create_result(input)
 
         doc_key = f"{input.raster_id}_{self._model_id}_{self._gamma_correction}"
 
         # check cache and re-use existing file if present
-        cached_data = self.fetch_cached_result(doc_key)
-        if cached_data:
+        doc_text, content_key = self._fetch_cached_extraction(input.image, doc_key)
+        if doc_text:
             logger.info(f"Using cached OCR results for raster: {input.raster_id}")
-            doc_text = DocTextExtraction.model_validate(cached_data)
             result = self._create_result(input)
             result.add_output(
                 self._output_key,
@@ -312,31 +444,28 @@ class TileTextExtractor(TextExtractor):
         ocr_blocks: List[Dict[str, Any]] = (
             []
         )  # list for OCR results across all tiles (whole image)
-        for tile_num, tile in enumerate(im_tiles):
-            logger.info(f"Processing tile {tile_num + 1} of {len(im_tiles)}")
-            # get OCR results for this tile
-            tile_ocr_blocks = self._extract_text(tile.image)
+        # get OCR results for all tiles (tiles are batched together into as few OCR API calls as possible)
+        tiles_ocr_blocks = self._extract_text_batch([tile.image for tile in im_tiles])
+        tile_idxs: List[int] = []  # source tile of each OCR block
+        for tile_idx, (tile, tile_ocr_blocks) in enumerate(
+            zip(im_tiles, tiles_ocr_blocks)
+        ):
             # convert OCR poly-bounds to global pixel coords and add to results
             ocr_blocks.extend(
                 GoogleVisionOCR.offset_ocr_coords(tile_ocr_blocks, tile.coordinates)
             )
+            tile_idxs.extend([tile_idx] * len(tile_ocr_blocks))
+        if self.stride_ratio < 1.0 and len(im_tiles) > 1:
+            # text in the tile overlap regions is OCR'd more than once
+            ocr_blocks = self._dedup_ocr_blocks(ocr_blocks, tile_idxs)
 
         # convert OCR results to TA1 schema
-        texts: List[TextExtraction] = []
-        for ocr_block in ocr_blocks:
-            bounds = [
-                Point(x=vertex.x, y=vertex.y)
-                for vertex in ocr_block["bounding_poly"].vertices
-            ]
-            ocr_result = TextExtraction(
-                text=ocr_block["text"], confidence=1.0, bounds=bounds
-            )
-            texts.append(ocr_result)
+        texts = self._ocr_blocks_to_extractions(ocr_blocks)
 
         doc_text_extraction = DocTextExtraction(doc_id=doc_key, extractions=texts)
 
         # write to cache
-        self.write_result_to_cache(doc_text_extraction, doc_key)
+        self._write_extraction_to_cache(doc_text_extraction, doc_key, content_key)
 
         result = self._create_result(input)
         result.add_output(self._output_key, doc_text_extraction.model_dump())
@@ -347,31 +476,82 @@ class TileTextExtractor(TextExtractor):
         split an image as needed to fit under the image size limit for x and y
         """
 
+        if image.mode != "RGB":
+            # OCR tiles are always RGB
+            image = image.convert("RGB")
         image_size = image.size
         splits_x = self._get_splits(image_size[0], size_limit)
         splits_y = self._get_splits(image_size[1], size_limit)
+        if len(splits_x) == 1 and len(splits_y) == 1:
+            # image fits in a single tile, so no need to copy it into a new tile image
+            return [Tile(image, (0, 0))]
         images: List[Tile] = []
         for split_y in splits_y:
             for split_x in splits_x:
-                ims = Image.new(
-                    mode="RGB", size=(split_x[1] - split_x[0], split_y[1] - split_y[0])
-                )
-                cropping = image.crop((split_x[0], split_y[0], split_x[1], split_y[1]))
-                ims.paste(cropping, (0, 0))
+                # (crop already returns a new image, so no need to paste into a blank tile)
+                ims = image.crop((split_x[0], split_y[0], split_x[1], split_y[1]))
                 images.append(Tile(ims, (split_x[0], split_y[0])))
         return images
 
     def _get_splits(self, size: int, limit: int) -> List[Tuple]:
         """
         get the pixel intervals for image tiling
-        note, currently the tile stride == limit (0% overlap)
+        note, the tile stride is the tile length scaled by stride_ratio (=1 for 0% overlap)
         """
-        splits = ceil(float(size) / limit)
-        split_inc = ceil(float(size) / splits)
+        # (integer ceiling division, avoiding float rounding for very large sizes)
+        splits = -(-size // limit)
+        split_inc = -(-size // splits)
+        stride = max(int(split_inc * self.stride_ratio), 1)
         split_vals: List[Tuple[int, float]] = []
         current = 0
         while current < size:
             next_inc = min(current + split_inc, size)
             split_vals.append((current, next_inc))
-            current = next_inc
+            if next_inc >= size:
+                break
+            current += stride
         return split_vals
+
+    def _dedup_ocr_blocks(
+        self, ocr_blocks: List[Dict[str, Any]], tile_idxs: List[int]
+    ) -> List[Dict[str, Any]]:
+        """
+        remove duplicate OCR blocks from overlapping tiles;
+        for blocks from different tiles with IoU > OCR_DEDUP_IOU_THRES, the block with the largest area is kept
+
+        Args:
+            ocr_blocks: OCR blocks in global pixel coords
+            tile_idxs: source tile index for each OCR block
+        Returns:
+            The de-duplicated list of OCR blocks
+        """
+        if len(ocr_blocks) < 2:
+            return ocr_blocks
+        bboxes = []
+        for ocr_block in ocr_blocks:
+            xs = [vertex.x for vertex in ocr_block["bounding_poly"].vertices]
+            ys = [vertex.y for vertex in ocr_block["bounding_poly"].vertices]
+            bboxes.append(box(min(xs), min(ys), max(xs), max(ys)))
+        areas = np.array([bbox.area for bbox in bboxes])
+
+        # only pairs of intersecting blocks need an IoU check
+        idx_a, idx_b = STRtree(bboxes).query(bboxes, predicate="intersects")
+        overlaps: Dict[int, List[int]] = {}
+        for a, b in zip(idx_a.tolist(), idx_b.tolist()):
+            if tile_idxs[a] == tile_idxs[b]:
+                continue
+            inter = bboxes[a].intersection(bboxes[b]).area
+            union = areas[a] + areas[b] - inter
+            if union > 0 and inter / union > OCR_DEDUP_IOU_THRES:
+                overlaps.setdefault(a, []).append(b)
+
+        # greedily keep the largest blocks, dropping any duplicates of a kept block
+        removed = np.zeros(len(ocr_blocks), dtype=bool)
+        for i in np.argsort(-areas, kind="stable").tolist():
+            if removed[i]:
+                continue
+            for j in overlaps.get(i, []):
+                removed[j] = True
+        return [
+            ocr_block for ocr_block, rm in zip(ocr_blocks, removed.tolist()) if not rm
+        ]
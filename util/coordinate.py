@@ -2,11 +2,9 @@ from typing import List
 
 
 def absolute_minmax(minmax: List[float]) -> List[float]:
-    minmax_abs = minmax.copy()
+    lo, hi = minmax[0], minmax[1]
+    lo_abs, hi_abs = abs(lo), abs(hi)
     # if the min max crosses 0, need to have it span from 0 to the furthest value
-    if minmax_abs[0] < 0 and minmax_abs[1] >= 0:
-        minmax_abs = [0, max(abs(minmax_abs[0]), abs(minmax_abs[1]))]
-    else:
-        minmax_abs = [abs(minmax_abs[0]), abs(minmax_abs[1])]
-        minmax_abs = [min(minmax_abs), max(minmax_abs)]
-    return minmax_abs
+    if lo < 0 and hi >= 0:
+        return [0, max(lo_abs, hi_abs)]
+    return [min(lo_abs, hi_abs), max(lo_abs, hi_abs)]
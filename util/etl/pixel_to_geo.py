@@ -1,5 +1,6 @@
 import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 from pathlib import Path
 import rasterio
@@ -10,7 +11,7 @@ from rasterio.transform import Affine, from_gcps
 
 from util.json import read_json_file
 
-from typing import Tuple
+from typing import Dict, Optional, Tuple
 
 
 def load_raw_geo_tiff(filepath: Path) -> np.ndarray:
@@ -40,17 +41,25 @@ def save_geo_tiff(filename: str, image: np.ndarray, crs: CRS, transform: Affine)
         fh.write(image)
 
 
-def build_geo_ref_csv_result(map_name: str, gcp_csv_path: str) -> Tuple[CRS, Affine]:
+def load_gcp_csv_groups(gcp_csv_path: str) -> Dict[str, pd.DataFrame]:
+    # read the gcp csv once, grouped by map, rather than once per map
+    df = pd.read_csv(gcp_csv_path)
+    return {str(raster_id): gcps for raster_id, gcps in df.groupby("raster_id")}
+
+
+def build_geo_ref_csv_result(
+    map_name: str, gcp_groups: Dict[str, pd.DataFrame]
+) -> Tuple[CRS, Affine]:
     # Default to WGS84
     crs = CRS.from_epsg(4326)
     # Possibly switch to NAD83? epsg num : 4269
-    df = pd.read_csv(gcp_csv_path)
-    map_gcps = df[df["raster_id"] == map_name]
+    map_gcps = gcp_groups.get(map_name)
     rasterio_gcps = []
-    for _, row in map_gcps.iterrows():
-        rasterio_gcps.append(
-            GroundControlPoint(row["row"], row["col"], row["NAD83_x"], row["NAD83_y"])
-        )
+    if map_gcps is not None:
+        for row in map_gcps.itertuples(index=False):
+            rasterio_gcps.append(
+                GroundControlPoint(row.row, row.col, row.NAD83_x, row.NAD83_y)
+            )
 
     transform = from_gcps(rasterio_gcps)
     return crs, transform
@@ -82,33 +91,73 @@ def build_geo_ref_schema_result(
     return crs, from_gcps(rasterio_gcps)
 
 
+def reproject_geo_tiff(
+    file_path: str, output_file_path: str, crs: CRS, gdal_transform: Tuple
+):
+    # copy the image to the output with the new CRS one block at a time, rather than
+    # loading the whole raster into memory
+    with rasterio.open(file_path) as src:
+        with rasterio.open(
+            output_file_path,
+            "w",
+            driver="GTiff",
+            compress="lzw",
+            height=src.height,
+            width=src.width,
+            count=src.count,
+            dtype=src.dtypes[0],
+            crs=crs,
+            transform=Affine.from_gdal(*gdal_transform),
+        ) as dst:
+            for _, window in src.block_windows(1):
+                dst.write(src.read(window=window), window=window)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--image_dir", type=str, required=True)
     parser.add_argument("--output_dir", type=str, required=True)
     parser.add_argument("--gcp_file", type=str, required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
     p = parser.parse_args()
 
     os.makedirs(p.output_dir, exist_ok=True)
 
-    for root, _, files in os.walk(p.image_dir):
-        for file in files:
-            print(f"processing {file}")
-            output_file_path = os.path.join(p.output_dir, file)
-            file_path = os.path.join(root, file)
-            map_id = os.path.splitext(file)[0]
-            if file_path.endswith("csv"):
-                crs, transform = build_geo_ref_csv_result(map_id, p.gcp_file)
-            else:
-                crs, transform = build_geo_ref_schema_result(
-                    map_id, os.path.join(p.gcp_file, f"{map_id}.json")
+    gcp_groups: Optional[Dict[str, pd.DataFrame]] = None
+    # each file is read, re-referenced and lzw compressed independently, which is cpu bound,
+    # so the files are processed in parallel across processes
+    with ProcessPoolExecutor(max_workers=p.workers) as executor:
+        futures = {}
+        for root, _, files in os.walk(p.image_dir):
+            for file in files:
+                print(f"processing {file}")
+                output_file_path = os.path.join(p.output_dir, file)
+                file_path = os.path.join(root, file)
+                map_id = os.path.splitext(file)[0]
+                if file_path.endswith("csv"):
+                    if gcp_groups is None:
+                        gcp_groups = load_gcp_csv_groups(p.gcp_file)
+                    crs, transform = build_geo_ref_csv_result(map_id, gcp_groups)
+                else:
+                    crs, transform = build_geo_ref_schema_result(
+                        map_id, os.path.join(p.gcp_file, f"{map_id}.json")
+                    )
+
+                # (the transform is passed to the worker in gdal form, since Affine objects
+                # can't be pickled by all affine versions)
+                future = executor.submit(
+                    reproject_geo_tiff,
+                    file_path,
+                    output_file_path,
+                    crs,
+                    transform.to_gdal(),
                 )
+                futures[future] = file
 
-            # load the image
-            im = load_raw_geo_tiff(file_path)
-
-            # save with the new CRS
-            save_geo_tiff(output_file_path, im, crs, transform)
+        for future in as_completed(futures):
+            # surface any errors from the worker processes
+            future.result()
+            print(f"processed {futures[future]}")
 
 
 if __name__ == "__main__":
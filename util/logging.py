@@ -1,4 +1,5 @@
 import logging
+import sys
 import coloredlogs
 
 
@@ -8,5 +9,9 @@ def config_logger(logger):
         format=f"%(asctime)s %(levelname)s %(name)s\t: %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     )
+    # coloured output is only useful on a terminal - when logging to a file or a container log
+    # the plain handler set up above is used, which skips coloredlogs' per-record overhead
+    if not sys.stderr.isatty():
+        return
     coloredlogs.DEFAULT_FIELD_STYLES["levelname"] = {"color": "white"}
     coloredlogs.install(logger=logger)